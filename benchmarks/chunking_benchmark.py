@@ -0,0 +1,67 @@
+"""Micro-benchmark of utils.chunk_text against LangChain's RecursiveCharacterTextSplitter.
+
+    python -m benchmarks.chunking_benchmark --pages 300 --repeat 5
+
+LangChain is no longer a dependency; when it is not installed only the native chunker is timed.
+"""
+import argparse
+import random
+import time
+from index_management.utils import chunk_text, iter_chunks
+
+WORDS = ["pump", "valve", "pressure", "the", "of", "maintenance", "inspect", "diagram", "legend", "flow",
+         "replace", "seal", "torque", "specification", "warning", "and", "to", "a", "operator", "cycle"]
+
+def generate_pages(pages, seed=0):
+    rng = random.Random(seed)
+    result = []
+    for page_number in range(pages):
+        paragraphs = []
+        for _ in range(rng.randint(4, 12)):
+            lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))) for _ in range(rng.randint(1, 8))]
+            paragraphs.append("\n".join(lines))
+        result.append((page_number, "\n\n".join(paragraphs)))
+    return result
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark text chunking.')
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunk_size', type=int, default=1000)
+    parser.add_argument('--chunk_overlap', type=int, default=200)
+    args = parser.parse_args()
+
+    pages = generate_pages(args.pages)
+    text = "\n".join(page_text for _, page_text in pages)
+    print(f"Corpus: {args.pages} pages, {len(text) / 1024:.0f} KB")
+
+    elapsed, chunks = best_of(lambda: chunk_text(text, args.chunk_size, args.chunk_overlap), args.repeat)
+    print(f"chunk_text (whole string)      {elapsed * 1000:8.1f} ms  {len(chunks)} chunks")
+    elapsed, chunks = best_of(lambda: list(iter_chunks(pages, args.chunk_size, args.chunk_overlap)), args.repeat)
+    print(f"iter_chunks (streamed pages)   {elapsed * 1000:8.1f} ms  {len(chunks)} chunks")
+
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        print("langchain is not installed; skipping RecursiveCharacterTextSplitter")
+        return
+
+    def langchain_split():
+        # Built per call, as the previous chunk_text did
+        splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                                  length_function=len)
+        return splitter.split_text(text)
+
+    elapsed, chunks = best_of(langchain_split, args.repeat)
+    print(f"RecursiveCharacterTextSplitter {elapsed * 1000:8.1f} ms  {len(chunks)} chunks")
+
+if __name__ == "__main__":
+    main()
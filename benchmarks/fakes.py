@@ -0,0 +1,241 @@
+"""In-process stand-ins for the Azure services, with injectable latency, throttling and failures.
+
+Each fake has the same surface the pipeline uses from the real client, so the production
+code paths, including their retries and backoff, run unchanged against them.
+"""
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from array import array
+from collections import namedtuple
+from requests import Response
+from requests.adapters import BaseAdapter
+
+ServiceProfile = namedtuple("ServiceProfile", ["latency_ms", "jitter_ms", "capacity", "throttle_rate", "failure_rate",
+                                               "retry_after"])
+ServiceProfile.__new__.__defaults__ = (0, 0, None, 0.0, 0.0, 0.1)
+
+# Rough medians observed against the real services
+DEFAULT_LATENCY_MS = {"blob": 30, "layout": 1500, "gpt4v": 4000, "embedding": 150, "search": 250}
+
+class FakeHttpError(Exception):
+    """Error carrying a status code and Retry-After header the way SDK and requests errors do."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Fake service returned {status_code}")
+        self.status_code = status_code
+        self.response = Response()
+        self.response.status_code = status_code
+        if retry_after:
+            self.response.headers["retry-after"] = str(retry_after)
+
+class FakeService:
+    """Simulates one service's latency, concurrency limit and error rates, and records call timings.
+
+    Calls beyond ``capacity`` concurrent ones are throttled with 429 when ``throttle`` is set,
+    otherwise they wait for a free slot, like a server-side queue.
+    """
+
+    def __init__(self, name, profile, throttle=True, seed=0):
+        self.name = name
+        self.profile = profile
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(profile.capacity) if profile.capacity and not throttle else None
+        self.in_flight = 0
+        self.timings = []
+        self.calls = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def call(self, inject_failures=True):
+        """Wait out one call's latency, raising FakeHttpError for injected throttling and failures."""
+        with self.lock:
+            self.calls += 1
+            over_capacity = self.profile.capacity is not None and self.in_flight >= self.profile.capacity
+            roll = self.random.random()
+            jitter = self.random.uniform(-self.profile.jitter_ms, self.profile.jitter_ms)
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            if self.throttle and (over_capacity or roll < self.profile.throttle_rate):
+                with self.lock:
+                    self.throttled += 1
+                raise FakeHttpError(429, self.profile.retry_after)
+            if self.slots is not None:
+                self.slots.acquire()
+            try:
+                time.sleep(max(0.0, self.profile.latency_ms + jitter) / 1000)
+            finally:
+                if self.slots is not None:
+                    self.slots.release()
+            if self.throttle and inject_failures and roll > 1 - self.profile.failure_rate:
+                with self.lock:
+                    self.failed += 1
+                raise FakeHttpError(503, self.profile.retry_after)
+        finally:
+            self.timings.append(time.perf_counter() - start)
+            with self.lock:
+                self.in_flight -= 1
+
+class FakeBlob:
+    def __init__(self, name, data):
+        self.name = name
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+        self.content_settings = None
+
+class FakeDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+class FakeBlobClient:
+    def __init__(self, container_client, blob_name):
+        self.container_client = container_client
+        self.blob_name = blob_name
+
+    def download_blob(self):
+        self.container_client.service.call()
+        return FakeDownload(self.container_client.blobs[self.blob_name])
+
+class FakeContainerClient:
+    """Container holding an in-memory corpus of {blob_name: pdf_bytes}."""
+
+    def __init__(self, blobs, profile=ServiceProfile()):
+        self.blobs = blobs
+        # The Blob SDK retries on its own, so this fake only adds latency and queueing
+        self.service = FakeService("blob", profile, throttle=False)
+
+    def exists(self):
+        return True
+
+    def list_blobs(self):
+        return [FakeBlob(name, data) for name, data in self.blobs.items()]
+
+    def get_blob_client(self, blob_name):
+        return FakeBlobClient(self, blob_name)
+
+FakeCell = namedtuple("FakeCell", ["row_index", "column_index", "content"])
+FakePoint = namedtuple("FakePoint", ["x", "y"])
+# bounding_box, as in the pinned azure-ai-formrecognizer; newer versions call it polygon
+FakeBoundingRegion = namedtuple("FakeBoundingRegion", ["page_number", "bounding_box"])
+FakeTable = namedtuple("FakeTable", ["row_count", "column_count", "cells", "bounding_regions"])
+FakePage = namedtuple("FakePage", ["page_number", "unit"])
+FakeLayout = namedtuple("FakeLayout", ["tables", "pages"])
+
+class FakePoller:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+class FakeFormRecognizerClient:
+    """Returns a deterministic set of tables for each document from begin_analyze_document.
+
+    The tables are placed in bands across the text of the first page, in inches like the real service.
+    """
+
+    def __init__(self, profile=ServiceProfile(), tables_per_document=2, rows=12, columns=5):
+        self.service = FakeService("layout", profile, throttle=False)
+        self.tables_per_document = tables_per_document
+        self.rows = rows
+        self.columns = columns
+
+    def begin_analyze_document(self, model_id, document):
+        self.service.call()
+        rng = random.Random(hashlib.sha1(document).digest())
+        tables = []
+        for i in range(self.tables_per_document):
+            cells = [FakeCell(row, column, f"r{row}c{column} {rng.randint(0, 99999)}")
+                     for row in range(self.rows) for column in range(self.columns)]
+            top = 1.5 + i
+            region = FakeBoundingRegion(1, [FakePoint(0.7, top), FakePoint(7.8, top),
+                                            FakePoint(7.8, top + 0.8), FakePoint(0.7, top + 0.8)])
+            tables.append(FakeTable(self.rows, self.columns, cells, [region]))
+        return FakePoller(FakeLayout(tables, [FakePage(1, "inch")]))
+
+class FakeGpt4vAdapter(BaseAdapter):
+    """requests adapter answering chat completion posts, mounted on the shared session."""
+
+    def __init__(self, profile=ServiceProfile(), description_words=120):
+        super().__init__()
+        self.service = FakeService("gpt4v", profile)
+        self.description_words = description_words
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.request = request
+        response.url = request.url
+        try:
+            self.service.call()
+        except FakeHttpError as e:
+            response.status_code = e.status_code
+            response.headers.update(e.response.headers)
+            response._content = b"{}"
+            return response
+        digest = hashlib.sha1(request.body if isinstance(request.body, bytes) else request.body.encode()).hexdigest()
+        description = " ".join(f"diagram-{digest[i % 40]}{i}" for i in range(self.description_words))
+        response.status_code = 200
+        response.headers["content-type"] = "application/json"
+        response._content = json.dumps({"choices": [{"message": {"content": description}}]}).encode()
+        return response
+
+    def close(self):
+        pass
+
+EmbeddingItem = namedtuple("EmbeddingItem", ["index", "embedding"])
+EmbeddingResponse = namedtuple("EmbeddingResponse", ["data"])
+
+class FakeEmbeddings:
+    def __init__(self, service, dimensions):
+        self.service = service
+        self.dimensions = dimensions
+
+    def create(self, model, input, encoding_format="float"):
+        self.service.call()
+        data = []
+        for index, text in enumerate(input):
+            rng = random.Random(hashlib.sha1(text.encode("utf-8")).digest())
+            vector = array("f", (rng.uniform(-1, 1) for _ in range(self.dimensions)))
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii") if encoding_format == "base64" else vector.tolist()
+            data.append(EmbeddingItem(index, embedding))
+        return EmbeddingResponse(data)
+
+class FakeOpenAIClient:
+    """Stand-in for AzureOpenAI exposing embeddings.create with deterministic vectors."""
+
+    def __init__(self, profile=ServiceProfile(), dimensions=1536):
+        self.service = FakeService("embedding", profile)
+        self.embeddings = FakeEmbeddings(self.service, dimensions)
+
+IndexingResult = namedtuple("IndexingResult", ["key", "succeeded", "status_code", "error_message"])
+
+class FakeSearchClient:
+    """Accepts merge_or_upload_documents; ``failure_rate`` fails single documents with a retryable 503."""
+
+    def __init__(self, profile=ServiceProfile()):
+        self.service = FakeService("search", profile)
+        self.random = random.Random(1)
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def merge_or_upload_documents(self, documents):
+        # Request-level throttling only; failures are reported per document in the results below
+        self.service.call(inject_failures=False)
+        results = []
+        with self.lock:
+            for document in documents:
+                if self.random.random() < self.service.profile.failure_rate:
+                    results.append(IndexingResult(document["id"], False, 503, "Fake service unavailable"))
+                    continue
+                self.documents[document["id"]] = document
+                results.append(IndexingResult(document["id"], True, 200, None))
+        return results
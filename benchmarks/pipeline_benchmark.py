@@ -0,0 +1,189 @@
+"""End-to-end ingestion benchmark against local service stand-ins; needs no Azure credentials.
+
+    python -m benchmarks.pipeline_benchmark --documents 40 --pages 20 --workers 4 --latency_scale 0.1
+    python -m benchmarks.pipeline_benchmark --capacity embedding=4 --throttle gpt4v=0.05 --failures search=0.01
+
+Drives process_new_files and upload_documents_to_index on a synthetic PDF corpus and reports
+docs/s, chunks/s, peak RSS, per-stage and per-service latency percentiles and the pipeline counters.
+"""
+import argparse
+import json
+import logging
+import resource
+import sys
+import time
+from benchmarks.fakes import (DEFAULT_LATENCY_MS, FakeContainerClient, FakeFormRecognizerClient, FakeGpt4vAdapter,
+                              FakeOpenAIClient, FakeSearchClient, ServiceProfile)
+from benchmarks.synthetic_pdfs import make_corpus
+from index_management.http_client import configure_http, get_session
+from index_management.image_triage import ImageTriage
+from index_management.metrics import get_metrics
+from index_management.pdf_processor import process_new_files
+from index_management.search_index import upload_documents_to_index
+
+SERVICES = ("blob", "layout", "gpt4v", "embedding", "search")
+GPT4V_ENDPOINT = "https://gpt4v.benchmark.invalid/chat/completions"
+
+def parse_service_values(pairs, cast):
+    """Parse ["embedding=4", "search=2"] into {"embedding": 4, "search": 2}."""
+    values = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        if name not in SERVICES or not value:
+            raise Exception(f"Expected <service>=<value> with a service in {SERVICES}, got {pair!r}.")
+        values[name] = cast(value)
+    return values
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize_service(service):
+    timings = sorted(service.timings)
+    return {
+        "calls": service.calls,
+        "throttled": service.throttled,
+        "failed": service.failed,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p90_ms": percentile(timings, 0.90) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+    }
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished child processes.
+
+    Text processes are started by a fork server, so they are not this process's children and
+    are not counted.
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return own / (1024 * 1024), children / (1024 * 1024)
+
+def build_profiles(args):
+    latency = dict(DEFAULT_LATENCY_MS, **parse_service_values(args.latency, float))
+    capacity = parse_service_values(args.capacity, int)
+    throttle = parse_service_values(args.throttle, float)
+    failures = parse_service_values(args.failures, float)
+    return {
+        name: ServiceProfile(latency_ms=latency[name] * args.latency_scale,
+                             jitter_ms=latency[name] * args.latency_scale * args.jitter,
+                             capacity=capacity.get(name), throttle_rate=throttle.get(name, 0.0),
+                             failure_rate=failures.get(name, 0.0), retry_after=args.retry_after)
+        for name in SERVICES
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingestion pipeline against fake Azure services.')
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=10, help='Pages per document')
+    parser.add_argument('--images', type=int, default=3, help='Distinct diagrams per document, besides the repeated logo')
+    parser.add_argument('--tables', type=int, default=2, help='Tables returned by the fake layout analysis per document')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--download_workers', type=int)
+    parser.add_argument('--layout_workers', type=int)
+    parser.add_argument('--text_workers', type=int)
+    parser.add_argument('--text_processes', type=int)
+    parser.add_argument('--vision_workers', type=int)
+    parser.add_argument('--embedding_workers', type=int)
+    parser.add_argument('--max_vision_requests', type=int, default=4)
+    parser.add_argument('--upload_workers', type=int, default=4)
+    parser.add_argument('--chunk_size', type=int, default=1000)
+    parser.add_argument('--chunk_overlap', type=int, default=200)
+    parser.add_argument('--latency', nargs='*', metavar='SERVICE=MS',
+                        help=f'Median latency per call, overriding {DEFAULT_LATENCY_MS}')
+    parser.add_argument('--latency_scale', type=float, default=1.0, help='Multiply every latency, e.g. 0.1 for quick runs')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Latency jitter as a fraction of the median')
+    parser.add_argument('--capacity', nargs='*', metavar='SERVICE=N',
+                        help='Concurrent calls a service accepts; gpt4v, embedding and search throttle beyond it, '
+                             'blob and layout queue')
+    parser.add_argument('--throttle', nargs='*', metavar='SERVICE=RATE', help='Fraction of calls answered with 429')
+    parser.add_argument('--failures', nargs='*', metavar='SERVICE=RATE',
+                        help='Fraction of calls (documents, for search) failing with a transient 503')
+    parser.add_argument('--retry_after', type=float, default=0.1, help='Retry-After seconds sent with injected errors')
+    parser.add_argument('--image_triage', action='store_true', help='Skip tiny and uniform images before GPT-4 Vision')
+    parser.add_argument('--max_image_dimension', type=int, default=0, help='Downscale larger images when triaging')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, help='Also write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show the pipeline logs')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    profiles = build_profiles(args)
+
+    corpus_start = time.perf_counter()
+    corpus = make_corpus(args.documents, args.pages, args.images, seed=args.seed)
+    corpus_mb = sum(len(data) for data in corpus.values()) / (1024 * 1024)
+    print(f"Corpus: {args.documents} documents x {args.pages} pages, {corpus_mb:.1f} MB "
+          f"(generated in {time.perf_counter() - corpus_start:.1f}s)")
+
+    container_client = FakeContainerClient(corpus, profiles["blob"])
+    form_recognizer_client = FakeFormRecognizerClient(profiles["layout"], tables_per_document=args.tables)
+    oai_client = FakeOpenAIClient(profiles["embedding"])
+    search_client = FakeSearchClient(profiles["search"])
+    gpt4v_adapter = FakeGpt4vAdapter(profiles["gpt4v"])
+    configure_http()
+    get_session().mount(GPT4V_ENDPOINT, gpt4v_adapter)
+
+    stage_workers = {
+        "download": args.download_workers,
+        "layout": args.layout_workers,
+        "text": args.text_workers,
+        "vision": args.vision_workers,
+        "embedding": args.embedding_workers,
+    }
+    start = time.perf_counter()
+    documents = process_new_files(container_client, form_recognizer_client, oai_client, GPT4V_ENDPOINT, {},
+                                  list(corpus), "benchmark", workers=args.workers, stage_workers=stage_workers,
+                                  max_vision_requests=args.max_vision_requests, text_processes=args.text_processes,
+                                  chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                  image_triage=ImageTriage(max_dimension=args.max_image_dimension) if args.image_triage else None)
+    processed = time.perf_counter()
+    failures = upload_documents_to_index(search_client, documents, workers=args.upload_workers)
+    finished = time.perf_counter()
+
+    own_rss, children_rss = peak_rss_mb()
+    elapsed = finished - start
+    report = {
+        "documents": args.documents,
+        "chunks": len(documents),
+        "upload_failures": len(failures),
+        "process_seconds": processed - start,
+        "upload_seconds": finished - processed,
+        "total_seconds": elapsed,
+        "docs_per_second": args.documents / elapsed,
+        "chunks_per_second": len(documents) / elapsed,
+        "peak_rss_mb": own_rss,
+        "peak_child_rss_mb": children_rss,
+        "pipeline": get_metrics().report(),
+        "services": {
+            "blob": summarize_service(container_client.service),
+            "layout": summarize_service(form_recognizer_client.service),
+            "gpt4v": summarize_service(gpt4v_adapter.service),
+            "embedding": summarize_service(oai_client.service),
+            "search": summarize_service(search_client.service),
+        },
+    }
+
+    print(f"Processed {report['chunks']} chunks in {report['process_seconds']:.1f}s, "
+          f"uploaded in {report['upload_seconds']:.1f}s ({report['upload_failures']} failures)")
+    print(f"Throughput: {report['docs_per_second']:.2f} docs/s, {report['chunks_per_second']:.1f} chunks/s")
+    print(f"Peak RSS: {own_rss:.0f} MB (finished child processes: {children_rss:.0f} MB)")
+    print(f"{'service':<10} {'calls':>7} {'429':>6} {'5xx':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for name, stats in report["services"].items():
+        print(f"{name:<10} {stats['calls']:>7} {stats['throttled']:>6} {stats['failed']:>6} "
+              f"{stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+    print(f"{'timer':<26} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'total s':>9}")
+    for name, stats in report["pipeline"]["timers"].items():
+        print(f"{name:<26} {stats['count']:>7} {stats['p50'] * 1000:>9.1f} {stats['p90'] * 1000:>9.1f} "
+              f"{stats['p99'] * 1000:>9.1f} {stats['sum']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
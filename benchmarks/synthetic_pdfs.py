@@ -0,0 +1,41 @@
+"""Synthetic PDF corpus for offline benchmarks, built with PyMuPDF.
+
+Every document has pages of generated text, a logo repeated on each page, which exercises
+image dedupe, a few distinct diagrams and a small solid bullet that image triage skips.
+Generation is deterministic for a given seed.
+"""
+import random
+import fitz  # PyMuPDF
+from benchmarks.chunking_benchmark import generate_pages
+
+def make_image(width, height, color, cells=1, rng=None):
+    """PNG bytes of an image filled with color, or of a cells x cells grid of random colors when rng is given."""
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pixmap.set_rect(pixmap.irect, color)
+    if rng is not None:
+        for row in range(cells):
+            for column in range(cells):
+                rect = fitz.IRect(column * width // cells, row * height // cells,
+                                  (column + 1) * width // cells, (row + 1) * height // cells)
+                pixmap.set_rect(rect, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return pixmap.tobytes("png")
+
+def make_pdf(pages=10, images=3, seed=0):
+    rng = random.Random(seed)
+    logo = make_image(120, 120, (20, 60, 120), cells=4, rng=random.Random(-1))
+    bullet = make_image(8, 8, (0, 0, 0))
+    image_pages = set(rng.sample(range(pages), min(images, pages)))
+    with fitz.open() as pdf_document:
+        for page_number, text in generate_pages(pages, seed=seed):
+            page = pdf_document.new_page()
+            page.insert_image(fitz.Rect(500, 20, 564, 84), stream=logo)
+            page.insert_image(fitz.Rect(40, 100, 46, 106), stream=bullet)
+            page.insert_textbox(fitz.Rect(50, 100, 560, 780), text, fontsize=8)
+            if page_number in image_pages:
+                color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                page.insert_image(fitz.Rect(50, 600, 350, 780), stream=make_image(600, 360, color, cells=12, rng=rng))
+        return pdf_document.tobytes()
+
+def make_corpus(documents=20, pages=10, images=3, seed=0):
+    """Return {blob_name: pdf_bytes} for a synthetic container."""
+    return {f"doc_{i:04d}.pdf": make_pdf(pages, images, seed=seed + i) for i in range(documents)}
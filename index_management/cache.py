@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Access times of cache hits are written in batches of this many, not one commit per lookup
+ACCESS_BATCH_SIZE = 1000
+
+class ModelCache:
+    """On-disk, content-addressed cache for model outputs backed by SQLite.
+
+    Keys are derived from the model, the prompt and a hash of the input so that a change to
+    any of them misses the cache. When the stored values exceed ``max_bytes`` the least
+    recently used entries are evicted. Access times of hits are kept in memory and written with
+    the next put, every ACCESS_BATCH_SIZE hits, and on log_stats and close.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "model_cache.sqlite3")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.pending_accesses = {}
+
+    @staticmethod
+    def make_key(kind, model, prompt, content):
+        content_hash = hashlib.sha256(content if isinstance(content, bytes) else content.encode("utf-8")).hexdigest()
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"{kind}:{model}:{prompt_hash}:{content_hash}"
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.pending_accesses[key] = time.time()
+            if len(self.pending_accesses) >= ACCESS_BATCH_SIZE:
+                self._write_accesses()
+                self.connection.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def _write_accesses(self):
+        if self.pending_accesses:
+            self.connection.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                                        [(accessed, key) for key, accessed in self.pending_accesses.items()])
+            self.pending_accesses = {}
+
+    def flush(self):
+        with self.lock:
+            self._write_accesses()
+            self.connection.commit()
+
+    def put(self, key, value):
+        size = len(value)
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+            self.stats["writes"] += 1
+            # Recent hits must be recorded before choosing what to evict
+            self._write_accesses()
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.connection.execute("SELECT key, size FROM entries ORDER BY accessed LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.stats["evictions"] += 1
+
+    def log_stats(self):
+        self.flush()
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        logging.info(f"Model cache {self.path}: {self.stats['hits']} hits, {self.stats['misses']} misses "
+                     f"({hit_rate:.1%} hit rate), {self.stats['writes']} writes, {self.stats['evictions']} evictions, "
+                     f"{self.total_bytes / (1024 * 1024):.1f} MB stored")
+
+    def close(self):
+        with self.lock:
+            self._write_accesses()
+            self.connection.commit()
+            self.connection.close()
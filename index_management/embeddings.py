@@ -0,0 +1,104 @@
+import logging
+from index_management.metrics import increment, timer
+from index_management.utils import get_status_code, retry_with_backoff
+from index_management.vectors import summarize_vector, to_vector
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+def estimate_tokens(text):
+    # cl100k averages roughly four characters per token on English text
+    return max(1, len(text) // 4)
+
+def is_throttled(error):
+    return get_status_code(error) in (429, 500, 502, 503, 504)
+
+class EmbeddingBatcher:
+    """Collects chunk documents and embeds them with multi-input requests.
+
+    Documents are embedded in the order they were added and their ``contentVector``
+    field is filled in place with a float32 array, so callers can keep building their document lists as before.
+    When an executor is given, full batches are sent concurrently and ``join`` waits for them.
+    Chunks found in the optional ModelCache are filled immediately without a request.
+    """
+
+    def __init__(self, oai_client, model=EMBEDDING_MODEL, max_items=16, max_tokens=8000, max_retries=5, executor=None,
+                 cache=None, max_pending_batches=8):
+        self.oai_client = oai_client
+        self.model = model
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.executor = executor
+        self.cache = cache
+        self.max_pending_batches = max_pending_batches
+        self.pending = []
+        self.pending_tokens = 0
+        self.futures = []
+
+    def add(self, document):
+        if self.cache is not None:
+            cached = self.cache.get(self._cache_key(document["content"]))
+            if cached is not None:
+                document["contentVector"] = to_vector(cached)
+                increment("embedding.cache_hits")
+                return
+
+        tokens = estimate_tokens(document["content"])
+        if self.pending and (len(self.pending) >= self.max_items or self.pending_tokens + tokens > self.max_tokens):
+            self.flush()
+        self.pending.append(document)
+        self.pending_tokens += tokens
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = []
+        self.pending_tokens = 0
+        if self.executor is None:
+            self._embed(batch)
+        else:
+            # Bound the number of batches in flight so producers cannot run ahead of the embedding pool
+            while len(self.futures) >= self.max_pending_batches:
+                self.futures.pop(0).result()
+            self.futures.append(self.executor.submit(self._embed, batch))
+
+    def reap(self):
+        """Re-raise the error of any finished batch and forget the completed ones."""
+        while self.futures and self.futures[0].done():
+            self.futures.pop(0).result()
+
+    def join(self):
+        self.flush()
+        futures = self.futures
+        self.futures = []
+        for future in futures:
+            future.result()
+
+    def _embed(self, batch):
+        texts = [document["content"] for document in batch]
+
+        def create():
+            increment("embedding.requests")
+            with timer("embedding.request"):
+                # base64 responses decode straight into float32 buffers without building float lists
+                return self.oai_client.embeddings.create(model=self.model, input=texts, encoding_format="base64")
+
+        response = retry_with_backoff(create, is_throttled, max_retries=self.max_retries, name="embedding")
+        usage = getattr(response, "usage", None)
+        increment("embedding.tokens", getattr(usage, "prompt_tokens", None) or sum(estimate_tokens(text) for text in texts))
+        increment("embedding.chunks", len(batch))
+        data = sorted(response.data, key=lambda item: item.index)
+        if len(data) != len(batch):
+            raise Exception(f"Embedding response returned {len(data)} vectors for {len(batch)} inputs.")
+
+        for document, item in zip(batch, data):
+            vector = to_vector(item.embedding)
+            document["contentVector"] = vector
+            logging.debug(f"Generated embedding for {document['id']}: {summarize_vector(vector)}")
+            if self.cache is not None:
+                self.cache.put(self._cache_key(document["content"]), vector.tobytes())
+        logging.info(f"Generated embeddings for {len(batch)} chunks")
+
+    def _cache_key(self, text):
+        return self.cache.make_key("embedding", self.model, "", text)
@@ -1,11 +1,21 @@
 import requests
 import base64
+import hashlib
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from index_management.http_client import get_session, get_timeout
+from index_management.metrics import increment, timer
+from index_management.utils import get_status_code, retry_with_backoff
 
-def analyze_image_with_gpt4v(image_path, gpt4v_endpoint, headers):
-    encoded_image = base64.b64encode(open(image_path, 'rb').read()).decode('ascii')
+def is_retryable(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return get_status_code(error) in (429, 500, 502, 503, 504)
 
-    payload = {
+def build_gpt4v_payload(encoded_image, image_ext="jpeg"):
+    return {
         "messages": [
             {
                 "role": "system",
@@ -17,7 +27,7 @@ def analyze_image_with_gpt4v(image_path, gpt4v_endpoint, headers):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}"
+                            "url": f"data:image/{image_ext};base64,{encoded_image}"
                         }
                     },
                     {
@@ -32,10 +42,104 @@ def analyze_image_with_gpt4v(image_path, gpt4v_endpoint, headers):
         "max_tokens": 800
     }
 
-    try:
-        response = requests.post(gpt4v_endpoint, headers=headers, json=payload)
+def analyze_image_bytes_with_gpt4v(image_bytes, gpt4v_endpoint, headers, image_ext="jpeg", max_retries=5):
+    encoded_image = base64.b64encode(image_bytes).decode('ascii')
+    payload = build_gpt4v_payload(encoded_image, image_ext)
+
+    def post():
+        increment("gpt4v.requests")
+        increment("gpt4v.bytes_sent", len(encoded_image))
+        with timer("gpt4v.request"):
+            response = get_session().post(gpt4v_endpoint, headers=headers, json=payload, timeout=get_timeout())
         response.raise_for_status()
         return response.json()
+
+    try:
+        result = retry_with_backoff(post, is_retryable, max_retries=max_retries, name="gpt4v")
     except requests.RequestException as e:
+        increment("gpt4v.failures")
         logging.error(f"Failed to make the request. Error: {e}")
         return None
+    usage = result.get("usage") or {}
+    increment("gpt4v.prompt_tokens", usage.get("prompt_tokens", 0))
+    increment("gpt4v.completion_tokens", usage.get("completion_tokens", 0))
+    return result
+
+def analyze_image_with_gpt4v(image_path, gpt4v_endpoint, headers):
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    return analyze_image_bytes_with_gpt4v(image_bytes, gpt4v_endpoint, headers)
+
+class ImageAnalyzer:
+    """Describes images with GPT-4 Vision, sending each distinct image at most once per run.
+
+    Images are keyed by the SHA-256 of their bytes. Requests run on a shared pool whose size
+    caps the number of vision calls in flight across all documents. Descriptions found in the
+    optional ModelCache are returned without a request. A failed description is forgotten, so
+    the image is tried again when a later document contains it.
+    """
+
+    def __init__(self, gpt4v_endpoint, headers, max_in_flight=4, cache=None):
+        self.gpt4v_endpoint = gpt4v_endpoint
+        self.headers = headers
+        self.cache = cache
+        self.prompt = json.dumps(build_gpt4v_payload(""), sort_keys=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="gpt4v")
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit(self, image_bytes, image_ext="jpeg"):
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        submitted = False
+        with self.lock:
+            future = self.futures.get(image_hash)
+            if future is None:
+                future = self.executor.submit(self._describe, image_bytes, image_ext)
+                self.futures[image_hash] = future
+                submitted = True
+            else:
+                increment("gpt4v.duplicate_images")
+                logging.info(f"Reusing GPT-4 Vision analysis for duplicate image {image_hash[:12]}")
+        if submitted:
+            # Added outside the lock, since the callback runs right here if the future is already done
+            future.add_done_callback(lambda done: self._forget_failure(image_hash, done))
+        return future
+
+    def _forget_failure(self, image_hash, future):
+        if future.exception() is None and future.result() is not None:
+            return
+        with self.lock:
+            if self.futures.get(image_hash) is future:
+                del self.futures[image_hash]
+
+    def describe_all(self, images):
+        """Return the description for each (page_number, image_bytes, image_ext), or None on failure."""
+        futures = [self.submit(image_bytes, image_ext) for _, image_bytes, image_ext in images]
+        return [future.result() for future in futures]
+
+    def _describe(self, image_bytes, image_ext):
+        cache_key = None
+        if self.cache is not None:
+            # The endpoint names the deployment, so a model change misses the cache
+            cache_key = self.cache.make_key("gpt4v", self.gpt4v_endpoint, self.prompt, image_bytes)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                increment("gpt4v.cache_hits")
+                return cached.decode("utf-8")
+
+        gpt4v_analysis = analyze_image_bytes_with_gpt4v(image_bytes, self.gpt4v_endpoint, self.headers, image_ext)
+        if not gpt4v_analysis:
+            return None
+        description = gpt4v_analysis["choices"][0]["message"]["content"]
+        if cache_key is not None:
+            self.cache.put(cache_key, description.encode("utf-8"))
+        return description
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,56 @@
+import threading
+
+# (connect, read) seconds; the read timeout covers slow GPT-4 Vision and layout responses
+DEFAULT_TIMEOUT = (10, 120)
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 32
+
+_settings = {"timeout": DEFAULT_TIMEOUT, "max_connections_per_host": DEFAULT_MAX_CONNECTIONS_PER_HOST}
+_session = None
+_lock = threading.Lock()
+
+def configure_http(max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST, timeout=None):
+    """Set pool limits and timeouts; call before the first client or session is created."""
+    global _session
+    with _lock:
+        _settings["max_connections_per_host"] = max_connections_per_host
+        if timeout is not None:
+            _settings["timeout"] = timeout if isinstance(timeout, tuple) else (DEFAULT_TIMEOUT[0], timeout)
+        _session = None
+
+def get_timeout():
+    return _settings["timeout"]
+
+def get_session():
+    """Process-wide requests session with keep-alive connection pools, one pool per host.
+
+    Each pool holds at most ``max_connections_per_host`` connections and callers block
+    for a free one, so thousands of requests reuse a handful of TLS connections.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=_settings["max_connections_per_host"], pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get_azure_transport():
+    """Transport for Azure SDK clients that shares the pooled session instead of opening its own."""
+    from azure.core.pipeline.transport import RequestsTransport
+    connect_timeout, read_timeout = get_timeout()
+    return RequestsTransport(session=get_session(), session_owner=False,
+                             connection_timeout=connect_timeout, read_timeout=read_timeout)
+
+def create_openai_http_client():
+    """httpx client for the OpenAI SDK with the same per-host connection limit and timeouts."""
+    import httpx
+    connect_timeout, read_timeout = get_timeout()
+    max_connections = _settings["max_connections_per_host"]
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
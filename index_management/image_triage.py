@@ -0,0 +1,80 @@
+import logging
+import math
+import fitz  # PyMuPDF
+from index_management.metrics import increment
+
+class ImageTriage:
+    """Decides locally which extracted images are worth a GPT-4 Vision call.
+
+    Images narrower or shorter than ``min_dimension`` pixels or smaller than ``min_area``
+    (icons, bullets, spacers) are skipped, as are near-uniform images whose largest
+    per-channel standard deviation is below ``min_stddev`` (solid backgrounds). With
+    ``max_dimension`` set, larger images are downscaled and re-encoded as JPEG when that
+    makes them smaller. Every decision is counted as ``image_triage.<decision>`` in the run report.
+    """
+
+    def __init__(self, min_dimension=50, min_area=10000, min_stddev=4.0, max_dimension=0, jpeg_quality=85):
+        self.min_dimension = min_dimension
+        self.min_area = min_area
+        self.min_stddev = min_stddev
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+
+    def triage(self, image_bytes, image_ext):
+        """Return (decision, image_bytes, image_ext); the bytes are None for skipped images."""
+        try:
+            pixmap = fitz.Pixmap(image_bytes)
+        except Exception as e:
+            # Formats PyMuPDF cannot decode on their own (e.g. JBIG2) are sent as they are
+            logging.debug(f"Could not decode {image_ext} image for triage: {e}")
+            return self._decide("unreadable", image_bytes, image_ext, image_bytes)
+
+        if min(pixmap.width, pixmap.height) < self.min_dimension or pixmap.width * pixmap.height < self.min_area:
+            return self._decide("too_small", None, image_ext, image_bytes)
+        if self.min_stddev and channel_stddev(pixmap) < self.min_stddev:
+            return self._decide("uniform", None, image_ext, image_bytes)
+
+        if self.max_dimension and max(pixmap.width, pixmap.height) > self.max_dimension:
+            try:
+                jpeg_bytes = downscale_to_jpeg(pixmap, self.max_dimension, self.jpeg_quality)
+            except Exception as e:
+                logging.debug(f"Could not downscale {image_ext} image: {e}")
+                jpeg_bytes = None
+            if jpeg_bytes is not None and len(jpeg_bytes) < len(image_bytes):
+                return self._decide("downscaled", jpeg_bytes, "jpeg", image_bytes)
+        return self._decide("kept", image_bytes, image_ext, image_bytes)
+
+    @staticmethod
+    def _decide(decision, image_bytes, image_ext, original_bytes):
+        increment(f"image_triage.{decision}")
+        if image_bytes is None:
+            increment("image_triage.bytes_skipped", len(original_bytes))
+        elif len(image_bytes) < len(original_bytes):
+            increment("image_triage.bytes_saved", len(original_bytes) - len(image_bytes))
+        return decision, image_bytes, image_ext
+
+def channel_stddev(pixmap, max_samples=4096):
+    """Largest standard deviation of any color channel, measured on a subsample of the pixels."""
+    channels = pixmap.n - pixmap.alpha
+    # A view of the pixel buffer; samples would copy the whole image
+    samples = pixmap.samples_mv
+    pixel_count = pixmap.width * pixmap.height
+    step = max(1, pixel_count // max_samples)
+    largest = 0.0
+    for channel in range(channels):
+        # Rows may be padded, so index through the stride rather than assuming n bytes per pixel
+        values = [samples[(i // pixmap.width) * pixmap.stride + (i % pixmap.width) * pixmap.n + channel]
+                  for i in range(0, pixel_count, step)]
+        mean = sum(values) / len(values)
+        largest = max(largest, math.sqrt(sum((value - mean) ** 2 for value in values) / len(values)))
+    return largest
+
+def downscale_to_jpeg(pixmap, max_dimension, jpeg_quality=85):
+    scale = max_dimension / max(pixmap.width, pixmap.height)
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    if pixmap.colorspace is None or pixmap.colorspace.n not in (1, 3):
+        # JPEG output needs gray or RGB, so CMYK and indexed images are converted first
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    scaled = fitz.Pixmap(pixmap, max(1, int(pixmap.width * scale)), max(1, int(pixmap.height * scale)), None)
+    return scaled.tobytes("jpeg", jpg_quality=jpeg_quality)
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+from index_management.vectors import decode_vector, encode_vector
+
+STAGES = ("downloaded", "analyzed", "embedded", "uploaded")
+
+# The journal is rewritten without the documents of uploaded blobs after this many uploads
+COMPACT_EVERY = 100
+
+class IngestionJournal:
+    """Append-only checkpoint log of per-blob ingestion progress.
+
+    Each line records that a blob reached a stage (downloaded, analyzed, embedded, uploaded).
+    The analyzed and embedded records carry the chunk documents produced so far, so a resumed
+    run can skip straight to embedding or uploading. Every record is flushed and fsynced
+    before the run moves on. Once a blob is uploaded its documents are no longer needed, so
+    the journal is compacted on resume and every COMPACT_EVERY uploads, keeping only their ids.
+    """
+
+    def __init__(self, path, resume=False, fresh=False):
+        self.path = path
+        self.lock = threading.RLock()
+        self.stages = {}
+        self.documents = {}
+        self.chunk_ids = {}
+        self.pending_uploads = {}
+        self.failed_blobs = set()
+        self.uploads_since_compaction = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path) and not resume and not fresh:
+            # Its blobs may be partly indexed, and a plain rerun would take them for finished ones
+            raise Exception(f"Journal {path} from an interrupted run exists. Pass --resume to finish that run, "
+                            f"or --fresh to discard the journal.")
+        if resume and os.path.exists(path):
+            self._load()
+            logging.info(f"Resuming from journal {path}: "
+                         + ", ".join(f"{sum(1 for s in self.stages.values() if s == stage)} {stage}" for stage in STAGES))
+        if resume and os.path.exists(path):
+            self._compact()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    @classmethod
+    def for_index(cls, journal_dir, index_name, container_name, resume=False, fresh=False):
+        return cls(os.path.join(journal_dir, f"{index_name}__{container_name}.jsonl"), resume=resume, fresh=fresh)
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half written; everything before it is intact
+                    logging.warning(f"Ignoring truncated journal entry in {self.path}")
+                    continue
+                blob_name = entry["blob"]
+                self.stages[blob_name] = entry["stage"]
+                if entry["stage"] == "uploaded":
+                    # Dropped right away so resuming holds only unfinished blobs' documents
+                    self.documents.pop(blob_name, None)
+                elif "documents" in entry:
+                    documents = [self._decode_document(document) for document in entry["documents"]]
+                    self.documents[blob_name] = documents
+                    self.chunk_ids[blob_name] = [document["id"] for document in documents]
+                if "chunk_ids" in entry:
+                    self.chunk_ids[blob_name] = entry["chunk_ids"]
+
+    def _compact(self):
+        """Rewrite the journal with the documents of uploaded blobs replaced by their chunk ids."""
+        temporary_path = f"{self.path}.tmp"
+        with open(self.path, "r", encoding="utf-8") as source, open(temporary_path, "w", encoding="utf-8") as target:
+            for line in source:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "documents" in entry and self.stages.get(entry["blob"]) == "uploaded":
+                    entry = {"blob": entry["blob"], "stage": entry["stage"],
+                             "chunk_ids": [document["id"] for document in entry["documents"]]}
+                    line = json.dumps(entry) + "\n"
+                target.write(line if line.endswith("\n") else line + "\n")
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(temporary_path, self.path)
+
+    @staticmethod
+    def _encode_document(document):
+        encoded = dict(document)
+        if encoded.get("contentVector") is not None:
+            encoded["contentVector"] = encode_vector(encoded["contentVector"])
+        return encoded
+
+    @staticmethod
+    def _decode_document(document):
+        if document.get("contentVector") is not None:
+            document["contentVector"] = decode_vector(document["contentVector"])
+        return document
+
+    def stage(self, blob_name):
+        return self.stages.get(blob_name)
+
+    def is_pending(self, blob_name):
+        """True when an earlier run started this blob but did not finish uploading it."""
+        return blob_name in self.stages and self.stages[blob_name] != "uploaded"
+
+    def record(self, blob_name, stage, documents=None):
+        entry = {"blob": blob_name, "stage": stage}
+        if documents is not None:
+            entry["documents"] = [self._encode_document(document) for document in documents]
+        line = json.dumps(entry)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.stages[blob_name] = stage
+            if documents is not None:
+                self.chunk_ids[blob_name] = [document["id"] for document in documents]
+            if stage == "uploaded":
+                self.uploads_since_compaction += 1
+                if self.uploads_since_compaction >= COMPACT_EVERY:
+                    self.file.close()
+                    self._compact()
+                    self.file = open(self.path, "a", encoding="utf-8")
+                    self.uploads_since_compaction = 0
+
+    def record_embedded(self, blob_name, documents, checkpoint=True):
+        """Checkpoint embedded documents and start counting their uploads.
+
+        Documents resumed from an embedded record are already journaled, so pass checkpoint=False.
+        """
+        with self.lock:
+            if checkpoint:
+                self.record(blob_name, "embedded", documents)
+            if documents:
+                self.pending_uploads[blob_name] = len(documents)
+            else:
+                self.record(blob_name, "uploaded")
+
+    def on_batch_uploaded(self, batch, failures):
+        failed_keys = {key for key, _, _ in failures}
+        with self.lock:
+            for document in batch:
+                blob_name = document["filepath"]
+                if document["id"] in failed_keys:
+                    self.failed_blobs.add(blob_name)
+                self.pending_uploads[blob_name] -= 1
+                if self.pending_uploads[blob_name] == 0:
+                    del self.pending_uploads[blob_name]
+                    if blob_name not in self.failed_blobs:
+                        self.record(blob_name, "uploaded")
+
+    def close(self, remove=False):
+        with self.lock:
+            self.file.close()
+            if remove:
+                os.remove(self.path)
@@ -1,110 +1,503 @@
-from azure.storage.blob import BlobServiceClient, ContainerClient
-from azure.storage.queue import QueueClient
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from openai import AzureOpenAI
 import argparse
 import logging
 import os
+import threading
+from collections import defaultdict
 from dotenv import load_dotenv
-from index_management.search_index import create_search_index_if_not_exists, delete_documents_from_index, list_existing_documents, upload_documents_to_index
-from index_management.blob_handler import get_blob_container_client, queue_blob_names
-from index_management.pdf_processor import process_new_files
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
+from index_management.cache import ModelCache
+from index_management.manifest import Manifest, get_content_md5
+from index_management.journal import IngestionJournal
+from index_management.http_client import configure_http, create_openai_http_client, get_azure_transport
+from index_management.metrics import get_metrics, profiled
+from index_management.worker import OPERATIONS, AzureJobQueue, SqliteJobQueue, Worker, make_job
+
+# The Azure SDKs, OpenAI and PyMuPDF are imported by the operations and clients that need
+# them, so short scheduled runs such as a delete do not pay for loading all of them
 
 # Load environment variables from .env file
 load_dotenv()
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
-def main():
-    parser = argparse.ArgumentParser(description='Process some PDFs.')
-    parser.add_argument('operation', type=str, help='Operation to perform (upload or delete)')
-    parser.add_argument('user_id', type=str, help='User ID')
-    parser.add_argument('container_name', type=str, help='Blob storage container name')
-    parser.add_argument('--blob_names', type=str, nargs='*', help='List of blob names to delete for delete operation')
-    args = parser.parse_args()
+def ingest_files(args, index_name, search_client, container_client, form_recognizer_client, oai_client, gpt4v_endpoint, headers,
+                 files, journal):
+    """Process files and stream their chunks into the index, checkpointing progress in the journal.
 
+    Returns the uploader, for its counts and failures, and the uploaded chunk ids per blob.
+    """
+    from index_management.image_triage import ImageTriage
+    from index_management.pdf_processor import iter_new_file_documents
+    from index_management.search_index import BackgroundUploader, report_upload_failures
 
-    operation = args.operation
-    user_id = args.user_id
-    container_name = args.container_name
-    blob_names_to_delete = args.blob_names
-
-    blob_connection_string = os.getenv('BlobConnectionString')
-    search_service_name = os.getenv('SearchServiceName')
-    search_admin_key = os.getenv('SearchAdminKey')
-    form_recognizer_endpoint = os.getenv('FormRecognizerEndpoint')
-    form_recognizer_key = os.getenv('FormRecognizerKey')
-    gpt4v_key = os.getenv('OPENAI_API_KEY_AUSEAST')
-    api_base = os.getenv('OPENAI_API_BASE_AUSEAST')
-    api_version = os.getenv('OPENAI_API_VERSION_AUSEAST')
-    model_auseast = os.getenv('MODEL_AUSEAST')
-
-    gpt4v_endpoint = f"https://{api_base}.openai.azure.com/openai/deployments/{model_auseast}/chat/completions?api-version={api_version}"
-
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": gpt4v_key,
+    stage_workers = {
+        "download": args.download_workers,
+        "layout": args.layout_workers,
+        "text": args.text_workers,
+        "vision": args.vision_workers,
+        "embedding": args.embedding_workers,
     }
+    chunk_ids = defaultdict(list)
+    image_triage = ImageTriage(min_dimension=args.min_image_dimension, min_area=args.min_image_area,
+                               min_stddev=args.min_image_stddev, max_dimension=args.max_image_dimension,
+                               jpeg_quality=args.jpeg_quality)
+    cache = ModelCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024) if args.cache_dir else None
+    try:
+        # Documents stream into the uploader as they are embedded instead of being collected first
+        with BackgroundUploader(search_client, upload_batch_size=args.upload_batch_size,
+                                max_batch_bytes=int(args.max_batch_mb * 1024 * 1024), workers=args.upload_workers,
+                                max_pending_batches=args.max_pending_batches,
+                                on_batch_uploaded=journal.on_batch_uploaded) as uploader:
+            for document in iter_new_file_documents(container_client, form_recognizer_client, oai_client, gpt4v_endpoint,
+                                                    headers, files, index_name, workers=args.workers,
+                                                    stage_workers=stage_workers,
+                                                    max_vision_requests=args.max_vision_requests, cache=cache,
+                                                    journal=journal, text_processes=args.text_processes,
+                                                    chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                                    chunk_unit=args.chunk_unit, table_format=args.table_format,
+                                                    image_triage=image_triage):
+                chunk_ids[document["filepath"]].append(document["id"])
+                uploader.add(document)
+    finally:
+        if cache is not None:
+            cache.log_stats()
+            cache.close()
+    report_upload_failures(uploader.failures)
+
+    # Blobs a previous run already uploaded were skipped, so their chunk ids come from the journal
+    for blob_name in files:
+        if blob_name not in chunk_ids and journal.stage(blob_name) == "uploaded":
+            chunk_ids[blob_name] = journal.chunk_ids.get(blob_name, [])
+    return uploader, chunk_ids
+
+def finish_journal(journal, uploader):
+    if uploader.failures:
+        journal.close()
+        logging.info(f"Journal kept at {journal.path}. Rerun with --resume to retry the failed files.")
+    else:
+        journal.close(remove=True)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Process some PDFs.')
+    parser.add_argument('operation', type=str, help='Operation to perform (upload, sync, delete, reindex or worker)')
+    parser.add_argument('user_id', type=str, nargs='?', help='User ID, or the source index for reindex (not used by worker)')
+    parser.add_argument('container_name', type=str, nargs='?',
+                        help='Blob storage container name (not used by reindex or worker)')
+    parser.add_argument('--blob_names', type=str, nargs='*', help='Blob names to delete, or to restrict an upload to')
+    parser.add_argument('--workers', type=int, default=1, help='Default number of concurrent workers per ingestion stage')
+    parser.add_argument('--download_workers', type=int, help='Concurrent blob downloads (defaults to --workers)')
+    parser.add_argument('--layout_workers', type=int, help='Concurrent Form Recognizer analyses (defaults to --workers)')
+    parser.add_argument('--text_workers', type=int, help='Concurrent PDF text extractions (defaults to --workers)')
+    parser.add_argument('--text_processes', type=int,
+                        help='Processes used to extract text from large PDFs page-parallel (defaults to the CPU count)')
+    parser.add_argument('--vision_workers', type=int, help='Concurrent GPT-4 Vision documents (defaults to --workers)')
+    parser.add_argument('--embedding_workers', type=int, help='Concurrent embedding requests (defaults to --workers)')
+    parser.add_argument('--max_vision_requests', type=int, default=4, help='Maximum GPT-4 Vision requests in flight across all documents')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='Maximum chunk length in --chunk_unit')
+    parser.add_argument('--chunk_overlap', type=int, default=200, help='Overlap between consecutive chunks in --chunk_unit')
+    parser.add_argument('--chunk_unit', type=str, choices=['chars', 'tokens'], default='chars',
+                        help='Measure chunks in characters or in embedding-model tokens')
+    parser.add_argument('--table_format', type=str, choices=['markdown', 'csv'], default='markdown',
+                        help='Serialization of table chunks; both repeat the header row in every chunk')
+    parser.add_argument('--min_image_dimension', type=int, default=50,
+                        help='Skip images narrower or shorter than this many pixels instead of sending them to GPT-4 Vision')
+    parser.add_argument('--min_image_area', type=int, default=10000, help='Skip images with fewer pixels than this')
+    parser.add_argument('--min_image_stddev', type=float, default=4.0,
+                        help='Skip near-uniform images whose color channels vary less than this (0 keeps them)')
+    parser.add_argument('--max_image_dimension', type=int, default=0,
+                        help='Downscale larger images to this size and re-encode them as JPEG before GPT-4 Vision (0 disables)')
+    parser.add_argument('--jpeg_quality', type=int, default=85, help='JPEG quality for downscaled images')
+    parser.add_argument('--upload_batch_size', type=int, default=1000, help='Maximum documents per index upload request')
+    parser.add_argument('--max_batch_mb', type=float, default=8, help='Maximum estimated payload size per upload request in MB')
+    parser.add_argument('--upload_workers', type=int, default=4, help='Concurrent index upload requests')
+    parser.add_argument('--max_pending_batches', type=int, default=8,
+                        help='Upload batches queued or in flight before ingestion waits for the uploader')
+    parser.add_argument('--cache_dir', type=str, default=os.getenv('MODEL_CACHE_DIR'),
+                        help='Directory for the persistent vision/embedding cache (disabled when unset)')
+    parser.add_argument('--cache_max_mb', type=int, default=int(os.getenv('MODEL_CACHE_MAX_MB', 1024)),
+                        help='Maximum size of the model cache in MB before LRU eviction')
+    parser.add_argument('--max_connections_per_host', type=int, default=32,
+                        help='Keep-alive connections per service host shared by all clients')
+    parser.add_argument('--http_timeout', type=float, default=120, help='Read timeout in seconds for service requests')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint journal of an interrupted upload or sync')
+    parser.add_argument('--fresh', action='store_true',
+                        help='Discard the checkpoint journal of an interrupted upload or sync instead of resuming it')
+    parser.add_argument('--journal_dir', type=str, default=os.getenv('JOURNAL_DIR', '.journals'),
+                        help='Directory holding the ingestion checkpoint journals')
+    parser.add_argument('--manifest_dir', type=str, default=os.getenv('MANIFEST_DIR', '.manifests'),
+                        help='Directory holding the sync manifests')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='Queue the upload, sync or delete as a job for a worker instead of running it')
+    parser.add_argument('--job_queue_path', type=str, default=os.getenv('JOB_QUEUE_PATH'),
+                        help='SQLite file used as a local job queue instead of the Azure job queue')
+    parser.add_argument('--worker_concurrency', type=int, default=4, help='Jobs a worker runs at once')
+    parser.add_argument('--visibility_timeout', type=int, default=300,
+                        help='Seconds a received job stays hidden from other workers between renewals')
+    parser.add_argument('--poll_interval', type=float, default=5, help='Seconds a worker waits when the queue is empty')
+    parser.add_argument('--max_attempts', type=int, default=5, help='Deliveries of a failing job before it is dropped')
+    parser.add_argument('--idle_exit', action='store_true', help='Stop the worker once the job queue is empty')
+    parser.add_argument('--language', type=str, help='Lucene analyzer language for content and title in new indexes, e.g. en')
+    parser.add_argument('--vector_dimensions', type=int, help='Vector dimensions of new indexes (defaults to VECTOR_DIMENSION)')
+    parser.add_argument('--hnsw_m', type=int, help='HNSW bi-directional links per node in new indexes')
+    parser.add_argument('--hnsw_ef_construction', type=int, help='HNSW candidate list size while building new indexes')
+    parser.add_argument('--hnsw_ef_search', type=int, help='HNSW candidate list size at query time in new indexes')
+    parser.add_argument('--vector_metric', type=str, choices=['cosine', 'euclidean', 'dotProduct'],
+                        help='Similarity metric of new indexes')
+    parser.add_argument('--target_index', type=str, help='Index that reindex creates with the schema flags and copies into')
+    parser.add_argument('--alias', type=str, help='Alias that reindex points to the target index once every document is copied')
+    parser.add_argument('--export_workers', type=int, default=8, help='Key partitions reindex exports concurrently')
+    parser.add_argument('--export_prefix_digits', type=int, default=1,
+                        help='Hex digits of the chunk key used to partition the export (16 partitions per chunk kind per digit)')
+    parser.add_argument('--export_page_size', type=int, default=1000, help='Documents per export request (at most 1000)')
+    parser.add_argument('--metrics_json', type=str, default=os.getenv('METRICS_JSON'),
+                        help='Write a JSON run report with stage timings, request counters and token counts')
+    parser.add_argument('--prometheus_textfile', type=str, default=os.getenv('PROMETHEUS_TEXTFILE'),
+                        help='Write the same metrics for the node_exporter textfile collector')
+    parser.add_argument('--profile_output', type=str, help='Profile the run with cProfile and write the stats here')
+    return parser
+
+class ServiceClients:
+    """Clients shared by every operation a process runs, each created on first use.
+
+    A delete only needs a search client, so it never builds the Blob, Form Recognizer or OpenAI clients.
+    """
 
-    if not blob_connection_string:
-        raise Exception("Blob connection string not found in environment variables.")
-    if not search_service_name or not search_admin_key:
-        raise Exception("Search service name or admin key not found in environment variables.")
-    if not form_recognizer_endpoint or not form_recognizer_key:
-        raise Exception("Form Recognizer endpoint or key not found in environment variables.")
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._oai_client = None
+        self._form_recognizer_client = None
+        self._blob_service_client = None
+        self.search_clients = {}
 
-    endpoint = f"https://{search_service_name}.search.windows.net"
-    search_client = SearchClient(endpoint=endpoint, index_name=user_id, credential=AzureKeyCredential(search_admin_key))
+    @property
+    def search_credentials(self):
+        search_service_name = os.getenv('SearchServiceName')
+        search_admin_key = os.getenv('SearchAdminKey')
+        if not search_service_name or not search_admin_key:
+            raise Exception("Search service name or admin key not found in environment variables.")
+        return search_service_name, search_admin_key
 
-    oai_client = AzureOpenAI(
-        api_key=os.getenv('AzureOpenaiApiKey'),
-        api_version="2024-02-01",
-        azure_endpoint=os.getenv('AzureOpenaiEndpoint')
-    )
+    @property
+    def gpt4v_endpoint(self):
+        api_base = os.getenv('OPENAI_API_BASE_AUSEAST')
+        api_version = os.getenv('OPENAI_API_VERSION_AUSEAST')
+        model_auseast = os.getenv('MODEL_AUSEAST')
+        return f"https://{api_base}.openai.azure.com/openai/deployments/{model_auseast}/chat/completions?api-version={api_version}"
 
-    form_recognizer_client = DocumentAnalysisClient(endpoint=form_recognizer_endpoint, credential=AzureKeyCredential(form_recognizer_key))
+    @property
+    def headers(self):
+        return {
+            "Content-Type": "application/json",
+            "api-key": os.getenv('OPENAI_API_KEY_AUSEAST'),
+        }
 
-    logging.info('Starting operation.')
+    @property
+    def oai_client(self):
+        with self.lock:
+            if self._oai_client is None:
+                from openai import AzureOpenAI
+                self._oai_client = AzureOpenAI(
+                    api_key=os.getenv('AzureOpenaiApiKey'),
+                    api_version="2024-02-01",
+                    azure_endpoint=os.getenv('AzureOpenaiEndpoint'),
+                    http_client=create_openai_http_client()
+                )
+            return self._oai_client
 
-    blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
-    container_client = blob_service_client.get_container_client(container_name)
-    
-    if not container_client.exists():
+    @property
+    def form_recognizer_client(self):
+        with self.lock:
+            if self._form_recognizer_client is None:
+                from azure.ai.formrecognizer import DocumentAnalysisClient
+                from azure.core.credentials import AzureKeyCredential
+                form_recognizer_endpoint = os.getenv('FormRecognizerEndpoint')
+                form_recognizer_key = os.getenv('FormRecognizerKey')
+                if not form_recognizer_endpoint or not form_recognizer_key:
+                    raise Exception("Form Recognizer endpoint or key not found in environment variables.")
+                self._form_recognizer_client = DocumentAnalysisClient(endpoint=form_recognizer_endpoint,
+                                                                      credential=AzureKeyCredential(form_recognizer_key),
+                                                                      transport=get_azure_transport())
+            return self._form_recognizer_client
+
+    def container_client(self, container_name):
+        with self.lock:
+            if self._blob_service_client is None:
+                from azure.storage.blob import BlobServiceClient
+                blob_connection_string = os.getenv('BlobConnectionString')
+                if not blob_connection_string:
+                    raise Exception("Blob connection string not found in environment variables.")
+                self._blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string,
+                                                                                     transport=get_azure_transport())
+            return self._blob_service_client.get_container_client(container_name)
+
+    def search_client(self, index_name):
+        search_service_name, search_admin_key = self.search_credentials
+        with self.lock:
+            if index_name not in self.search_clients:
+                from azure.core.credentials import AzureKeyCredential
+                from azure.search.documents import SearchClient
+                self.search_clients[index_name] = SearchClient(endpoint=f"https://{search_service_name}.search.windows.net",
+                                                               index_name=index_name,
+                                                               credential=AzureKeyCredential(search_admin_key),
+                                                               transport=get_azure_transport())
+            return self.search_clients[index_name]
+
+    def ensure_index(self, index_name, language=None, vector_dimensions=None, hnsw_parameters=None):
+        from index_management.search_index import create_search_index_if_not_exists
+        search_service_name, search_admin_key = self.search_credentials
+        create_search_index_if_not_exists(service_name=search_service_name, index_name=index_name,
+                                          semantic_config_name="azureml-default", admin_key=search_admin_key,
+                                          language=language, vector_config_name="default",
+                                          vector_dimensions=vector_dimensions, hnsw_parameters=hnsw_parameters)
+
+def index_schema_options(args):
+    """Schema settings from the command line, applied when an index is created."""
+    hnsw_parameters = {name: value for name, value in (("m", args.hnsw_m), ("efConstruction", args.hnsw_ef_construction),
+                                                       ("efSearch", args.hnsw_ef_search), ("metric", args.vector_metric))
+                       if value is not None}
+    return {"language": args.language, "vector_dimensions": args.vector_dimensions, "hnsw_parameters": hnsw_parameters or None}
+
+def list_pdf_blobs(container_client, container_name):
+    """List the container's PDFs once per run; a missing container fails here instead of costing an extra request."""
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        return [blob for blob in container_client.list_blobs() if blob.name.lower().endswith('.pdf')]
+    except ResourceNotFoundError:
         raise Exception(f"Container '{container_name}' does not exist in the blob storage.")
 
-    # Create the search index if it doesn't exist
-    create_search_index_if_not_exists(service_name=search_service_name, index_name=user_id, 
-                                      semantic_config_name="azureml-default", admin_key=search_admin_key,
-                                      language=None, vector_config_name="default")
+def write_run_reports(args, **run_info):
+    metrics = get_metrics()
+    metrics.log_summary()
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json, **run_info)
+    if args.prometheus_textfile:
+        metrics.write_prometheus(args.prometheus_textfile)
+
+def get_job_queue(args):
+    if args.job_queue_path:
+        return SqliteJobQueue(args.job_queue_path)
+    queue_connection_string = os.getenv('QueueConnectionString')
+    job_queue_name = os.getenv('JobQueueName')
+    if not queue_connection_string or not job_queue_name:
+        raise Exception("Queue connection string or job queue name not found in environment variables.")
+    return AzureJobQueue(queue_connection_string, job_queue_name,
+                         lease_container=os.getenv('JobLeaseContainer', 'job-leases'))
+
+def run_operation(args, clients, operation, user_id, container_name, blob_names=None, resume=False):
+    """Run one upload, sync or delete for an index and container.
+
+    With blob_names, upload only considers those blobs; delete requires them.
+    """
+    from index_management.search_index import delete_documents_by_key, delete_documents_from_index, list_existing_documents
+
+    search_client = clients.search_client(user_id)
+    blob_names_to_delete = blob_names
+
+    logging.info(f'Starting {operation} for index {user_id}, container {container_name}.')
+
+    if operation in ("upload", "sync"):
+        container_client = clients.container_client(container_name)
+        form_recognizer_client = clients.form_recognizer_client
+        oai_client = clients.oai_client
+        gpt4v_endpoint = clients.gpt4v_endpoint
+        headers = clients.headers
+        blobs = list_pdf_blobs(container_client, container_name)
 
-    # List all PDF files in the container
-    blob_names = [blob.name for blob in container_client.list_blobs() if blob.name.lower().endswith('.pdf')]
+        # Create the search index if it doesn't exist; the answer is remembered for the rest of the process
+        clients.ensure_index(user_id, **index_schema_options(args))
+
+        # Opened before choosing files so an interrupted run's partially uploaded files are picked up again
+        journal = IngestionJournal.for_index(args.journal_dir, user_id, container_name, resume=resume,
+                                             fresh=args.fresh and not resume)
 
     if operation == "upload":
         existing_files = list_existing_documents(search_client)
-        new_files = [blob.name for blob in container_client.list_blobs() if blob.name.lower().endswith('.pdf') and blob.name not in existing_files]
+        new_files = [blob.name for blob in blobs
+                     if (blob.name not in existing_files or journal.is_pending(blob.name))
+                     and (not blob_names or blob.name in blob_names)]
 
         if not new_files:
             logging.info("No new files to index.")
+            journal.close(remove=True)
             return
 
-        documents = process_new_files(container_client, form_recognizer_client, oai_client, gpt4v_endpoint, headers, new_files, user_id)
-        if documents:
-            upload_documents_to_index(search_client, documents)
-            queue_blob_names(new_files)
+        uploader, _ = ingest_files(args, user_id, search_client, container_client, form_recognizer_client, oai_client,
+                                   gpt4v_endpoint, headers, new_files, journal)
+        finish_journal(journal, uploader)
+        if uploader.uploaded:
+            from index_management.blob_handler import queue_blob_names
+            # Only queue files whose chunks were all indexed
+            failed_files = {filepath for _, filepath, _ in uploader.failures}
+            queue_blob_names([blob_name for blob_name in new_files if blob_name not in failed_files])
         else:
             logging.info("No new documents to upload.")
 
+    elif operation == "sync":
+        manifest = Manifest.for_index(args.manifest_dir, user_id, container_name)
+        if not manifest.exists:
+            manifest.seed(blobs, list_existing_documents(search_client))
+        added, changed, removed = manifest.diff(blobs)
+        logging.info(f"Sync: {len(added)} added, {len(changed)} changed, {len(removed)} removed blobs.")
+
+        # Chunks that an earlier sync or delete failed to remove are retried first
+        if manifest.stale_chunk_ids:
+            logging.info(f"Retrying deletion of {len(manifest.stale_chunk_ids)} stale chunks")
+            manifest.stale_chunk_ids = delete_documents_by_key(search_client, manifest.stale_chunk_ids)
+
+        # Blobs adopted from the index have no recorded chunk ids, so their old chunks go before re-indexing
+        unknown_chunks = [blob_name for blob_name in changed + removed if manifest.blobs[blob_name]["chunk_ids"] is None]
+        if unknown_chunks:
+            manifest.add_stale(delete_documents_from_index(search_client, user_id, unknown_chunks))
+        for blob_name in removed:
+            # Keys that fail to delete stay in the manifest for the next sync, since the blob itself is gone
+            manifest.add_stale(delete_documents_by_key(search_client, manifest.blobs[blob_name]["chunk_ids"] or []))
+            manifest.remove(blob_name)
+
+        to_index = added + changed
+        if to_index:
+            uploader, chunk_ids = ingest_files(args, user_id, search_client, container_client, form_recognizer_client, oai_client,
+                                               gpt4v_endpoint, headers, to_index, journal)
+            failed_files = {filepath for _, filepath, _ in uploader.failures}
+            blobs_by_name = {blob.name: blob for blob in blobs}
+            stale_ids = []
+            for blob_name in to_index:
+                if blob_name in failed_files:
+                    continue
+                new_ids = chunk_ids.get(blob_name, [])
+                # Old chunks that were not overwritten by a new chunk with the same id are stale
+                old_ids = (manifest.blobs.get(blob_name) or {}).get("chunk_ids") or []
+                stale_ids.extend(set(old_ids) - set(new_ids))
+                blob = blobs_by_name[blob_name]
+                manifest.record(blob_name, blob.etag, get_content_md5(blob), new_ids)
+            manifest.add_stale(delete_documents_by_key(search_client, stale_ids))
+            manifest.save()
+            finish_journal(journal, uploader)
+        else:
+            manifest.save()
+            journal.close(remove=True)
+        if manifest.stale_chunk_ids:
+            logging.warning(f"{len(manifest.stale_chunk_ids)} stale chunks could not be deleted. "
+                            f"They are kept in the manifest and retried on the next sync.")
+
     elif operation == "delete":
         if not blob_names_to_delete:
             raise Exception("No blob names specified for deletion.")
-        delete_documents_from_index(search_client, user_id, blob_names_to_delete)
+        # Chunk keys recorded by sync avoid querying the index at all
+        manifest = Manifest.for_index(args.manifest_dir, user_id, container_name)
+        known = [blob_name for blob_name in blob_names_to_delete if (manifest.blobs.get(blob_name) or {}).get("chunk_ids") is not None]
+        unknown = [blob_name for blob_name in blob_names_to_delete if blob_name not in known]
+        failed_keys = delete_documents_by_key(search_client,
+                                              [key for blob_name in known for key in manifest.blobs[blob_name]["chunk_ids"]])
+        if unknown:
+            failed_keys += delete_documents_from_index(search_client, user_id, unknown)
+        if manifest.exists:
+            for blob_name in blob_names_to_delete:
+                manifest.remove(blob_name)
+            # The next sync retries them, as the blobs no longer have manifest entries of their own
+            manifest.add_stale(failed_keys)
+            manifest.save()
+        if failed_keys:
+            raise Exception(f"{len(failed_keys)} chunks could not be deleted. "
+                            + ("The next sync retries them." if manifest.exists else "Rerun the delete to retry them."))
     else:
         raise Exception(f"Operation {operation} is not supported.")
 
+def run_reindex(args, clients, source_index):
+    """Copy an index, vectors included, into a new index with the current schema flags and optionally switch an alias."""
+    from index_management.search_index import (copy_index_documents, get_search_index, index_schema_differences,
+                                               key_partitions, point_alias_to_index, report_upload_failures,
+                                               sample_vector_dimensions)
+
+    target_index = args.target_index
+    if not target_index or target_index == source_index:
+        raise Exception("reindex needs a --target_index different from the source index.")
+    schema_options = index_schema_options(args)
+    vector_dimensions = schema_options["vector_dimensions"] or int(os.getenv("VECTOR_DIMENSION", 1536))
+
+    # Checked before the target is created, so a mismatch does not leave an empty index behind
+    source_dimensions = sample_vector_dimensions(clients.search_client(source_index))
+    if source_dimensions is not None and source_dimensions != vector_dimensions:
+        raise Exception(f"{source_index} stores {source_dimensions}-dimensional vectors but the target index would "
+                        f"have {vector_dimensions}. Changing dimensions needs new embeddings; run upload instead.")
+
+    # An existing target is only reused, e.g. to retry failed documents, if it has the requested schema
+    search_service_name, search_admin_key = clients.search_credentials
+    existing = get_search_index(search_service_name, search_admin_key, target_index)
+    if existing is not None:
+        differences = index_schema_differences(existing, **schema_options)
+        if differences:
+            raise Exception(f"Target index {target_index} already exists with a different schema: "
+                            f"{'; '.join(differences)}. Delete it or choose another --target_index.")
+        logging.info(f"Target index {target_index} already exists with the requested schema; copying into it")
+    clients.ensure_index(target_index, **schema_options)
+
+    partitions = key_partitions(prefix_digits=args.export_prefix_digits)
+    logging.info(f"Reindexing {source_index} into {target_index} over {len(partitions)} key partitions")
+    exported, uploader = copy_index_documents(clients.search_client(source_index), clients.search_client(target_index),
+                                              partitions, export_workers=args.export_workers,
+                                              page_size=min(args.export_page_size, 1000),
+                                              upload_batch_size=args.upload_batch_size,
+                                              max_batch_bytes=int(args.max_batch_mb * 1024 * 1024),
+                                              upload_workers=args.upload_workers,
+                                              max_pending_batches=args.max_pending_batches,
+                                              vector_dimensions=vector_dimensions)
+    report_upload_failures(uploader.failures)
+    logging.info(f"Copied {uploader.uploaded} of {exported} documents from {source_index} to {target_index}")
+
+    if args.alias:
+        if uploader.failures:
+            raise Exception(f"Alias {args.alias} was not switched because {len(uploader.failures)} documents failed to copy. "
+                            f"Rerun reindex to retry them.")
+        point_alias_to_index(search_service_name, search_admin_key, args.alias, target_index)
+
+def main():
+    args = build_parser().parse_args()
+    operation = args.operation
+
+    if operation != "worker":
+        if operation not in OPERATIONS + ("reindex",):
+            raise Exception(f"Operation {operation} is not supported.")
+        if not args.user_id:
+            raise Exception(f"Operation {operation} requires an index name.")
+        if operation != "reindex" and not args.container_name:
+            raise Exception(f"Operation {operation} requires an index name and a container name.")
+        if args.enqueue:
+            if operation == "reindex":
+                raise Exception("reindex runs in the foreground and cannot be queued.")
+            get_job_queue(args).send(make_job(operation, args.user_id, args.container_name, args.blob_names))
+            logging.info(f"Queued {operation} job for index {args.user_id}, container {args.container_name}.")
+            return
+
+    # Every client shares one pool of keep-alive connections instead of handshaking per request
+    configure_http(max_connections_per_host=args.max_connections_per_host, timeout=args.http_timeout)
+    clients = ServiceClients()
+
+    if operation == "worker":
+        def handle_job(job):
+            try:
+                run_operation(args, clients, job["operation"], job["index"], job["container"], job["blob_names"],
+                              resume=True)
+            finally:
+                # Metrics accumulate over the worker's lifetime; refresh the reports after every job
+                write_run_reports(args, operation="worker")
+
+        # One warm process serves every index and container on the queue. A redelivered job
+        # continues from the journal its failed attempt left behind.
+        worker = Worker(get_job_queue(args), handle_job, concurrency=args.worker_concurrency,
+                        visibility_timeout=args.visibility_timeout, poll_interval=args.poll_interval,
+                        max_attempts=args.max_attempts)
+        with profiled(args.profile_output):
+            worker.run(idle_exit=args.idle_exit)
+    else:
+        try:
+            with profiled(args.profile_output):
+                if operation == "reindex":
+                    run_reindex(args, clients, args.user_id)
+                else:
+                    run_operation(args, clients, operation, args.user_id, args.container_name, args.blob_names,
+                                  resume=args.resume)
+        finally:
+            write_run_reports(args, operation=operation, index=args.user_id, container=args.container_name)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,82 @@
+import base64
+import json
+import logging
+import os
+import tempfile
+
+def get_content_md5(blob):
+    content_settings = getattr(blob, "content_settings", None)
+    content_md5 = getattr(content_settings, "content_md5", None)
+    return base64.b64encode(bytes(content_md5)).decode("ascii") if content_md5 else None
+
+class Manifest:
+    """Local record of what has been indexed from a container.
+
+    For every blob it keeps the ETag and content MD5 seen when it was indexed and the chunk
+    ids that were uploaded for it, so a sync only has to touch blobs that changed. Chunk ids
+    are ``None`` for blobs found in the index before the manifest existed. Chunk ids that could
+    not be deleted are kept in ``stale_chunk_ids`` until a later sync deletes them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.exists = os.path.exists(path)
+        self.blobs = {}
+        self.stale_chunk_ids = []
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.blobs = data["blobs"]
+            self.stale_chunk_ids = data.get("stale_chunk_ids", [])
+
+    @classmethod
+    def for_index(cls, manifest_dir, index_name, container_name):
+        return cls(os.path.join(manifest_dir, f"{index_name}__{container_name}.json"))
+
+    def seed(self, blobs, indexed_files):
+        """Adopt blobs that are already in the index when no manifest was kept yet."""
+        for blob in blobs:
+            if blob.name in indexed_files:
+                self.record(blob.name, blob.etag, get_content_md5(blob), None)
+        logging.info(f"Seeded manifest with {len(self.blobs)} blobs already in the index")
+
+    def diff(self, blobs):
+        """Return (added, changed, removed) blob names relative to the current container listing."""
+        added, changed = [], []
+        seen = set()
+        for blob in blobs:
+            seen.add(blob.name)
+            entry = self.blobs.get(blob.name)
+            if entry is None:
+                added.append(blob.name)
+            elif entry["etag"] != blob.etag:
+                content_md5 = get_content_md5(blob)
+                # A new ETag with identical content (e.g. a metadata update) does not need re-indexing
+                if content_md5 is None or content_md5 != entry["content_md5"]:
+                    changed.append(blob.name)
+                else:
+                    entry["etag"] = blob.etag
+        removed = [blob_name for blob_name in self.blobs if blob_name not in seen]
+        return added, changed, removed
+
+    def record(self, blob_name, etag, content_md5, chunk_ids):
+        self.blobs[blob_name] = {"etag": etag, "content_md5": content_md5, "chunk_ids": chunk_ids}
+
+    def remove(self, blob_name):
+        self.blobs.pop(blob_name, None)
+
+    def add_stale(self, chunk_ids):
+        self.stale_chunk_ids = list(dict.fromkeys(self.stale_chunk_ids + list(chunk_ids)))
+
+    def save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Chunk ids are deterministic, so a re-indexed blob can reuse a key that failed to delete earlier
+        current = {chunk_id for entry in self.blobs.values() for chunk_id in entry["chunk_ids"] or []}
+        self.stale_chunk_ids = [chunk_id for chunk_id in self.stale_chunk_ids if chunk_id not in current]
+        # Write to a temp file and rename so a crash never leaves a truncated manifest
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, encoding="utf-8") as f:
+            json.dump({"blobs": self.blobs, "stale_chunk_ids": self.stale_chunk_ids}, f)
+            temp_name = f.name
+        os.replace(temp_name, self.path)
+        self.exists = True
@@ -0,0 +1,195 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds shared by every timer, from a fast cache hit to a slow layout analysis
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+PROMETHEUS_PREFIX = "index_management"
+
+class Histogram:
+    """Bucketed distribution of durations with exact count, sum, min and max."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations, capped at the maximum."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        cumulative = 0
+        for upper_bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(upper_bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min or 0.0,
+            "max": self.max or 0.0,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+        }
+
+class Metrics:
+    """Thread-safe counters and timers for one process, exported as a JSON report or a Prometheus textfile."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def report(self, **run_info):
+        with self.lock:
+            return {
+                "run": dict(run_info, started=self.started, elapsed_seconds=time.time() - self.started),
+                "counters": dict(sorted(self.counters.items())),
+                "timers": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            }
+
+    def write_json(self, path, **run_info):
+        _write_atomically(path, json.dumps(self.report(**run_info), indent=2))
+        logging.info(f"Wrote run report to {path}")
+
+    def write_prometheus(self, path):
+        """Write counters and timer histograms in the text format read by node_exporter's textfile collector."""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = _prometheus_name(name) + "_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = _prometheus_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for upper_bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if upper_bound == float("inf") else repr(upper_bound)
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+                lines += [f"{metric}_sum {histogram.sum}", f"{metric}_count {histogram.count}"]
+        _write_atomically(path, "\n".join(lines) + "\n")
+        logging.info(f"Wrote Prometheus metrics to {path}")
+
+    def log_summary(self):
+        report = self.report()
+        for name, timer in report["timers"].items():
+            logging.info(f"{name}: {timer['count']} calls, p50 {timer['p50']:.3f}s, p99 {timer['p99']:.3f}s, "
+                         f"total {timer['sum']:.1f}s")
+        for name, value in report["counters"].items():
+            logging.info(f"{name}: {value}")
+
+def _prometheus_name(name):
+    return f"{PROMETHEUS_PREFIX}_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def _write_atomically(path, text):
+    # Readers such as the textfile collector must never see a half-written file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temporary_path, path)
+
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
+
+def reset_metrics():
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+def increment(name, amount=1):
+    _metrics.increment(name, amount)
+
+def observe(name, seconds):
+    _metrics.observe(name, seconds)
+
+def timer(name):
+    return _metrics.timer(name)
+
+@contextmanager
+def profiled(path=None):
+    """Profile the enclosed block with cProfile and dump the stats to path; does nothing without a path.
+
+    Threads started inside the block, such as the stage workers and the request executors, are
+    profiled too and merged into one file. Inspect it with ``python -m pstats <path>`` or a viewer
+    such as snakeviz.
+    """
+    if not path:
+        yield
+        return
+    profilers = []
+    lock = threading.Lock()
+
+    def start_profiler(*_):
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    # From Python 3.12, cProfile hooks sys.monitoring, which already sees every thread and allows
+    # one profiler at a time. Before that, a profiler only sees the thread that enabled it.
+    per_thread = sys.version_info < (3, 12)
+    start_profiler()
+    main_profiler = profilers[0]
+    if per_thread:
+        # Runs on each new thread's first call; enabling a profiler there replaces this hook
+        threading.setprofile(start_profiler)
+    try:
+        yield
+    finally:
+        if per_thread:
+            threading.setprofile(None)
+        main_profiler.disable()
+        with lock:
+            stats = pstats.Stats(*profilers)
+        stats.dump_stats(path)
+        logging.info(f"Wrote profile of {len(profilers)} threads to {path}" if per_thread else f"Wrote profile to {path}")
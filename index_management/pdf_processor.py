@@ -1,201 +1,322 @@
 import logging
-import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 # from fitz import open as fitz_open
-from index_management.utils import chunk_text
-from langchain.document_loaders import PyPDFLoader
+from index_management.embeddings import EMBEDDING_MODEL, EmbeddingBatcher
+from index_management.gpt4v_handler import ImageAnalyzer
+from index_management.metrics import increment, timer
+from index_management.pipeline import resolve_stage_workers, run_pipeline
+from index_management.tables import build_table, page_text_outside_tables, table_chunks, table_regions
+from index_management.utils import chunk_text, iter_chunks, token_length_function
 import os
 import fitz  # PyMuPDF
-import time
-import base64
-import requests
-
-def extract_tables_from_pdf(blob_client, form_recognizer_client):
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        blob_data = blob_client.download_blob()
-        blob_data.readinto(temp_file)
-        temp_file.flush()
-        temp_file_name = temp_file.name
-
-    with open(temp_file_name, "rb") as f:
-        poller = form_recognizer_client.begin_analyze_document("prebuilt-layout", document=f)
-    result = poller.result()
-
-    os.remove(temp_file_name)
-
-    tables = []
-    for table in result.tables:
-        table_data = []
-        for cell in table.cells:
-            table_data.append({
-                "row_index": cell.row_index,
-                "column_index": cell.column_index,
-                "content": cell.content
-            })
-        tables.append(table_data)
-
-    return tables
+import hashlib
+
+# PDFs with at least this many pages have their text extracted across the process pool
+PARALLEL_TEXT_MIN_PAGES = 64
+
+class PdfContext:
+    """Per-document state for a blob: the PDF is downloaded once and analyzed once."""
+
+    def __init__(self, blob_client, form_recognizer_client):
+        self.blob_client = blob_client
+        self.blob_name = blob_client.blob_name
+        self.form_recognizer_client = form_recognizer_client
+        self.pdf_bytes = None
+        self.pdf_document = None
+        self._layout = None
+        self.page_texts = []
+        self.image_descriptions = []
+
+    def download(self):
+        if self.pdf_bytes is None:
+            self.pdf_bytes = self.blob_client.download_blob().readall()
+            increment("blob.bytes_downloaded", len(self.pdf_bytes))
+            self.pdf_document = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+            increment("pdf.pages", len(self.pdf_document))
+        return self.pdf_bytes
+
+    @property
+    def layout(self):
+        if self._layout is None:
+            poller = self.form_recognizer_client.begin_analyze_document("prebuilt-layout", document=self.download())
+            self._layout = poller.result()
+        return self._layout
+
+    def close(self):
+        if self.pdf_document is not None:
+            self.pdf_document.close()
+            self.pdf_document = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def extract_tables_from_pdf(layout_result):
+    return [build_table(table) for table in layout_result.tables]
 
 def extract_images_from_pdf(pdf_document):
+    """Return (page_number, image_bytes, image_ext) for every distinct image in the PDF.
+
+    Images repeated across pages, either through the same xref or identical bytes, are
+    returned once for their first page.
+    """
     images = []
+    seen_xrefs = set()
+    seen_hashes = set()
     for page_number in range(len(pdf_document)):
         page = pdf_document.load_page(page_number)
-        for image_index, img in enumerate(page.get_images(full=True)):
+        for img in page.get_images(full=True):
             xref = img[0]
+            if xref in seen_xrefs:
+                continue
+            seen_xrefs.add(xref)
             base_image = pdf_document.extract_image(xref)
             image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{image_ext}") as temp_file:
-                temp_file.write(image_bytes)
-                image_path = temp_file.name
-            images.append((page_number, image_path))
+            image_hash = hashlib.sha256(image_bytes).digest()
+            if image_hash in seen_hashes:
+                continue
+            seen_hashes.add(image_hash)
+            images.append((page_number, image_bytes, base_image["ext"]))
     return images
 
-def analyze_image_with_gpt4v(image_path, gpt4v_endpoint, headers):
-    encoded_image = base64.b64encode(open(image_path, 'rb').read()).decode('ascii')
-    
-    payload = {
-        "messages": [
-            {
-                "role": "system",
-                "content": "You can analyze images. You are an expert in understanding diagrams and workflows based on legends found in an image."
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}"
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "text": "Analyze this image and describe its contents, including any legends, diagrams, or workflows you can identify."
-                    }
-                ]
-            }
-        ],
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "max_tokens": 800
-    }
-
-    try:
-        response = requests.post(gpt4v_endpoint, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Failed to make the request. Error: {e}")
-        return None
-
-def has_tables(blob_client, form_recognizer_client):
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        blob_data = blob_client.download_blob()
-        blob_data.readinto(temp_file)
-        temp_file.flush()
-        temp_file_name = temp_file.name
-
-    with open(temp_file_name, "rb") as f:
-        poller = form_recognizer_client.begin_analyze_document("prebuilt-layout", document=f)
-    result = poller.result()
-
-    os.remove(temp_file_name)
-
-    return len(result.tables) > 0
-
-def process_new_files(container_client, form_recognizer_client, oai_client, gpt4v_endpoint, headers, new_files, user_id):
+def _extract_page_range(pdf_bytes, start, end, table_rects=None):
+    # Runs in a worker process, which opens its own copy of the document
+    table_rects = table_rects or {}
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return [(page_number, page_text_outside_tables(pdf_document.load_page(page_number), table_rects.get(page_number)))
+                for page_number in range(start, end)]
+
+def extract_page_texts(pdf_document, pdf_bytes=None, process_pool=None, processes=1, table_rects=None):
+    """Return (page_number, text) for every page of an open PyMuPDF document.
+
+    Text inside table_rects ({page_number: [rect, ...]}) is left out, since tables are chunked on
+    their own. Large PDFs are split into one contiguous page range per process and extracted in
+    parallel on process_pool; smaller ones are read in place to avoid shipping the bytes to another process.
+    """
+    table_rects = table_rects or {}
+    page_count = len(pdf_document)
+    if process_pool is None or pdf_bytes is None or processes < 2 or page_count < PARALLEL_TEXT_MIN_PAGES:
+        return [(page_number, page_text_outside_tables(pdf_document.load_page(page_number), table_rects.get(page_number)))
+                for page_number in range(page_count)]
+
+    step = -(-page_count // processes)
+    futures = [process_pool.submit(_extract_page_range, pdf_bytes, start, min(start + step, page_count),
+                                   {page: rects for page, rects in table_rects.items() if start <= page < start + step})
+               for start in range(0, page_count, step)]
+    return [page for future in futures for page in future.result()]
+
+def has_tables(layout_result):
+    return len(layout_result.tables) > 0
+
+def open_pdf_context(container_client, form_recognizer_client, blob_name):
+    context = PdfContext(container_client.get_blob_client(blob_name), form_recognizer_client)
+    context.download()
+    return context
+
+def analyze_layout(context):
+    context.layout
+    return context
+
+def extract_text(context, process_pool=None, processes=1):
+    # Layout runs first, so the text of its tables can be left out of the page text
+    context.page_texts = extract_page_texts(context.pdf_document, context.pdf_bytes, process_pool, processes,
+                                            table_regions(context.layout))
+    return context
+
+def analyze_images(context, image_analyzer, image_triage=None):
+    images = extract_images_from_pdf(context.pdf_document)
+    candidates = []
+    for image_index, (page_number, image_bytes, image_ext) in enumerate(images):
+        if image_triage is not None:
+            decision, image_bytes, image_ext = image_triage.triage(image_bytes, image_ext)
+            logging.debug(f"Image {image_index} on page {page_number + 1} of {context.blob_name}: {decision}")
+            if image_bytes is None:
+                continue
+        candidates.append((image_index, (page_number, image_bytes, image_ext)))
+    logging.info(f"Analyzing {len(candidates)} of {len(images)} distinct images in {context.blob_name} with GPT-4 Vision...")
+    descriptions = image_analyzer.describe_all([image for _, image in candidates])
+    # Keep each image's position among the extracted images so its chunk ids do not shift when another image fails or is skipped
+    context.image_descriptions = [
+        (page_number, image_index, description)
+        for (image_index, (page_number, _, _)), description in zip(candidates, descriptions)
+        if description
+    ]
+    return context
+
+def make_chunk_id(blob_name, kind, position, chunk_index):
+    """Stable key for a chunk, so re-runs overwrite the same documents instead of adding new ones.
+
+    Search keys only allow letters, digits, dashes, underscores and equal signs, hence the hash.
+    """
+    digest = hashlib.sha1(f"{blob_name}\x00{kind}\x00{position}\x00{chunk_index}".encode("utf-8")).hexdigest()
+    return f"{kind}_{digest}"
+
+def page_url(blob_name, page_number):
+    # PDF viewers understand the #page fragment, which is 1-based
+    return f"{blob_name}#page={page_number + 1}"
+
+def build_documents(context, chunk_size=1000, chunk_overlap=200, length_function=len, table_format="markdown"):
+    """Chunk the tables, image descriptions and text of an analyzed PDF into documents without vectors."""
+    blob_name = context.blob_name
+
+    def split(text):
+        return chunk_text(text, chunk_size, chunk_overlap, length_function)
+
     documents = []
-    id = 1
-    for blob_name in new_files:
-        blob_client = container_client.get_blob_client(blob_name)
-
-        # Read and process the PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            blob_data = blob_client.download_blob()
-            blob_data.readinto(temp_file)
-            temp_file_name = temp_file.name
-
-        try:
-            pdf_document = fitz.open(temp_file_name)
-
-            # Extract and process tables
-            if has_tables(blob_client, form_recognizer_client):
-                logging.info(f"Tables found in {blob_name}. Extracting tables...")
-                tables = extract_tables_from_pdf(blob_client, form_recognizer_client)
-                for table_id, table in enumerate(tables):
-                    table_content = "\n".join([cell["content"] for cell in table])
-                    table_chunks = chunk_text(table_content)
-                    for j, chunk in enumerate(table_chunks):
-                        response = oai_client.embeddings.create(model="text-embedding-ada-002", input=chunk)
-                        vector = response.dict()['data'][0]['embedding']
-                        logging.info(f"Generated Embedding for table chunk {j}: {vector}")
-
-                        document = {
-                            "id": f"{id}_table_{table_id}_{j}",
-                            "filepath": blob_name,
-                            "content": chunk,
-                            "metadata": blob_name,
-                            "contentVector": vector,
-                            "@search.action": "upload"
-                        }
-                        documents.append(document)
-                    id += 1
-
-            # Extract and process images
-            images = extract_images_from_pdf(pdf_document)
-            for page_number, image_path in images:
-                logging.info(f"Analyzing image on page {page_number} with GPT-4 Vision...")
-                gpt4v_analysis = analyze_image_with_gpt4v(image_path, gpt4v_endpoint, headers)
-                if gpt4v_analysis:
-                    gpt4v_response = gpt4v_analysis["choices"][0]["message"]["content"]
-                    image_chunks = chunk_text(gpt4v_response)
-                    for k, chunk in enumerate(image_chunks):
-                        response = oai_client.embeddings.create(model="text-embedding-ada-002", input=chunk)
-                        vector = response.dict()['data'][0]['embedding']
-                        logging.info(f"Generated Embedding for image chunk {k}: {vector}")
-
-                        document = {
-                            "id": f"{id}_image_{page_number}_{k}",
-                            "filepath": blob_name,
-                            "content": chunk,
-                            "metadata": blob_name,
-                            "contentVector": vector,
-                            "@search.action": "upload"
-                        }
-                        documents.append(document)
-                        id += 1
-                    os.remove(image_path)
-
-            # Process remaining content
-            logging.info(f"Processing remaining content of {blob_name}...")
-            loader = PyPDFLoader(temp_file_name)
-            pages = loader.load()
-                
-            if pages is not None:
-                content = "\n".join([page.page_content for page in pages])
-                chunks = chunk_text(content)
-                for i, chunk in enumerate(chunks):
-                    response = oai_client.embeddings.create(model="text-embedding-ada-002", input=chunk)
-                    vector = response.dict()['data'][0]['embedding']
-                    logging.info(f"Generated Embedding for chunk {i}: {vector}")
-
-                    document = {
-                        "id": f"{id}_{i}",
-                        "filepath": blob_name,
-                        "content": chunk,
-                        "metadata": blob_name,
-                        "contentVector": vector,
-                            "@search.action": "upload"
-                    }
-                    documents.append(document)
-                id += 1
-
-            pdf_document.close()
-        finally:
-            time.sleep(0.1)  # Small delay before attempting to delete
-            try:
-                os.remove(temp_file_name)
-            except PermissionError:
-                logging.warning(f"Unable to delete temporary file: {temp_file_name}")
+
+    # Extract and process tables
+    if has_tables(context.layout):
+        logging.info(f"Tables found in {blob_name}. Extracting tables...")
+        tables = extract_tables_from_pdf(context.layout)
+        for table_id, table in enumerate(tables):
+            # Whole rows under a repeated header, so every chunk can be read on its own
+            for j, chunk in enumerate(table_chunks(table, chunk_size, length_function, table_format)):
+                document = {
+                    "id": make_chunk_id(blob_name, "table", table_id, j),
+                    "filepath": blob_name,
+                    "content": chunk,
+                    "url": page_url(blob_name, table.page_number) if table.page_number is not None else None,
+                    "metadata": blob_name,
+                    "contentVector": None,
+                    "@search.action": "mergeOrUpload"
+                }
+                documents.append(document)
+
+    # Process image descriptions
+    for page_number, image_index, gpt4v_response in context.image_descriptions:
+        image_chunks = split(gpt4v_response)
+        for k, chunk in enumerate(image_chunks):
+            document = {
+                "id": make_chunk_id(blob_name, "image", f"{page_number}_{image_index}", k),
+                "filepath": blob_name,
+                "content": chunk,
+                "url": page_url(blob_name, page_number),
+                "metadata": blob_name,
+                "contentVector": None,
+                "@search.action": "mergeOrUpload"
+            }
+            documents.append(document)
+
+    # Stream the pages through the chunker, so every chunk knows the page it starts on
+    logging.info(f"Processing remaining content of {blob_name}...")
+    for i, text_chunk in enumerate(iter_chunks(context.page_texts, chunk_size, chunk_overlap, length_function)):
+        document = {
+            "id": make_chunk_id(blob_name, "text", text_chunk.page_number, i),
+            "filepath": blob_name,
+            "content": text_chunk.text,
+            "url": page_url(blob_name, text_chunk.page_number),
+            "metadata": blob_name,
+            "contentVector": None,
+            "@search.action": "mergeOrUpload"
+        }
+        documents.append(document)
 
     return documents
+
+def text_process_context():
+    """Start text processes from a clean server process rather than forking this multithreaded one.
+
+    The pool starts its processes when the first large PDF arrives, by which time the stage,
+    request and HTTP pool threads are running, and forking then can deadlock on a lock held by one of them.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def iter_new_file_documents(container_client, form_recognizer_client, oai_client, gpt4v_endpoint, headers, new_files, user_id,
+                            workers=1, stage_workers=None, max_vision_requests=4, cache=None, journal=None,
+                            text_processes=None, chunk_size=1000, chunk_overlap=200, chunk_unit="chars",
+                            table_format="markdown", image_triage=None):
+    """Yield embedded chunk documents for new_files as soon as each blob's vectors are ready.
+
+    Documents are yielded in the same order as a serial run. Because this is a generator and
+    the pipeline holds at most twice the largest stage worker count of PDFs, a slow consumer pauses downloads
+    and analysis instead of letting processed documents pile up.
+    With a journal, each blob's progress is checkpointed, and blobs an earlier run already
+    analyzed or embedded resume from their journaled documents instead of starting over.
+    """
+    stage_workers = resolve_stage_workers(workers, stage_workers)
+    length_function = token_length_function(EMBEDDING_MODEL) if chunk_unit == "tokens" else len
+    text_processes = text_processes or os.cpu_count() or 1
+
+    def download(blob_name):
+        context = open_pdf_context(container_client, form_recognizer_client, blob_name)
+        if journal is not None:
+            journal.record(blob_name, "downloaded")
+        return context
+
+    stages = [
+        ("download", download, stage_workers["download"]),
+        ("layout", analyze_layout, stage_workers["layout"]),
+        ("text", lambda context: extract_text(context, text_pool, text_processes), stage_workers["text"]),
+        ("vision", lambda context: analyze_images(context, image_analyzer, image_triage), stage_workers["vision"]),
+    ]
+
+    resumed = []
+    if journal is not None:
+        pipeline_files = []
+        for blob_name in new_files:
+            stage = journal.stage(blob_name)
+            if stage in ("analyzed", "embedded"):
+                resumed.append((blob_name, stage, journal.documents.pop(blob_name)))
+            elif stage != "uploaded":
+                pipeline_files.append(blob_name)
+        if len(pipeline_files) < len(new_files):
+            logging.info(f"Journal: resuming {len(resumed)} files, skipping "
+                         f"{len(new_files) - len(pipeline_files) - len(resumed)} already uploaded")
+        new_files = pipeline_files
+    logging.info(f"Processing {len(new_files)} files with stage workers {stage_workers}")
+
+    def embedded(blob_name, documents, checkpoint=True):
+        if journal is not None:
+            journal.record_embedded(blob_name, documents, checkpoint)
+        return documents
+
+    with ImageAnalyzer(gpt4v_endpoint, headers, max_in_flight=max_vision_requests, cache=cache) as image_analyzer, \
+            ProcessPoolExecutor(max_workers=text_processes, mp_context=text_process_context()) as text_pool, \
+            ThreadPoolExecutor(max_workers=stage_workers["embedding"]) as embedding_executor:
+        batcher = EmbeddingBatcher(oai_client, executor=embedding_executor, cache=cache,
+                                   max_pending_batches=stage_workers["embedding"] * 2)
+        awaiting_vectors = deque()
+
+        for blob_name, stage, blob_documents in resumed:
+            if stage == "embedded":
+                yield from embedded(blob_name, blob_documents, checkpoint=False)
+            else:
+                for document in blob_documents:
+                    batcher.add(document)
+                awaiting_vectors.append((blob_name, blob_documents))
+
+        # Results arrive in new_files order, so document order matches a serial run
+        for blob_name, context in run_pipeline(new_files, stages, maxsize=max(stage_workers.values()) * 2):
+            with context, timer("stage.chunking"):
+                blob_documents = build_documents(context, chunk_size, chunk_overlap, length_function, table_format)
+            increment("documents.processed")
+            increment("chunks.built", len(blob_documents))
+            if journal is not None:
+                journal.record(blob_name, "analyzed", blob_documents)
+            for document in blob_documents:
+                batcher.add(document)
+            awaiting_vectors.append((blob_name, blob_documents))
+
+            batcher.reap()
+            while awaiting_vectors and all(document["contentVector"] is not None for document in awaiting_vectors[0][1]):
+                yield from embedded(*awaiting_vectors.popleft())
+
+        # Embed whatever is still queued after the last document
+        batcher.join()
+        while awaiting_vectors:
+            yield from embedded(*awaiting_vectors.popleft())
+
+def process_new_files(container_client, form_recognizer_client, oai_client, gpt4v_endpoint, headers, new_files, user_id,
+                      workers=1, stage_workers=None, max_vision_requests=4, cache=None, text_processes=None,
+                      chunk_size=1000, chunk_overlap=200, chunk_unit="chars", table_format="markdown", image_triage=None):
+    return list(iter_new_file_documents(container_client, form_recognizer_client, oai_client, gpt4v_endpoint, headers,
+                                        new_files, user_id, workers=workers, stage_workers=stage_workers,
+                                        max_vision_requests=max_vision_requests, cache=cache,
+                                        text_processes=text_processes, chunk_size=chunk_size,
+                                        chunk_overlap=chunk_overlap, chunk_unit=chunk_unit, table_format=table_format,
+                                        image_triage=image_triage))
@@ -0,0 +1,113 @@
+import logging
+import queue
+import threading
+from index_management.metrics import timer
+
+STAGE_NAMES = ("download", "layout", "text", "vision", "embedding")
+
+_SENTINEL = object()
+
+def resolve_stage_workers(workers=1, stage_workers=None):
+    """Return the worker count for every stage, falling back to ``workers`` for stages not overridden."""
+    resolved = {name: max(1, workers) for name in STAGE_NAMES}
+    for name, count in (stage_workers or {}).items():
+        if name not in resolved:
+            raise Exception(f"Unknown pipeline stage '{name}'. Expected one of {STAGE_NAMES}.")
+        if count:
+            resolved[name] = max(1, count)
+    return resolved
+
+class Stage:
+    """A bounded pool of worker threads applying func to items from input_queue.
+
+    Items travel as (sequence, payload, error) tuples. Once an item has failed, or once stopped
+    is set, it is passed through untouched so the error surfaces at the consumer in input order.
+    """
+
+    def __init__(self, name, func, workers, output_queue, maxsize=0, stopped=None):
+        self.name = name
+        self.func = func
+        self.stopped = stopped or threading.Event()
+        self.input_queue = queue.Queue(maxsize)
+        self.output_queue = output_queue
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.input_queue.get()
+            if item is _SENTINEL:
+                break
+            sequence, payload, error = item
+            if error is None and not self.stopped.is_set():
+                try:
+                    with timer(f"stage.{self.name}"):
+                        payload = self.func(payload)
+                except Exception as e:
+                    logging.error(f"Stage '{self.name}' failed for item {sequence}: {e}")
+                    error = e
+            self.output_queue.put((sequence, payload, error))
+
+    def close(self):
+        for _ in self.threads:
+            self.input_queue.put(_SENTINEL)
+        for thread in self.threads:
+            thread.join()
+
+def run_pipeline(items, stages, maxsize=0):
+    """Run items through a chain of stages joined by queues.
+
+    ``stages`` is a list of (name, func, workers) tuples. Yields (item, result) pairs in the
+    same order as ``items`` regardless of which worker finished first, and re-raises the
+    first error in that order.
+
+    With ``maxsize``, at most that many items are between the feeder and the consumer at once,
+    counting items waiting in the reorder buffer, so a slow item or a slow consumer pauses
+    feeding. Once the consumer stops (an error or closing the generator), items not yet started
+    are no longer fed and items in flight skip the remaining stages.
+    """
+    items = list(items)
+    output_queue = queue.Queue()
+    stopped = threading.Event()
+    in_flight = threading.BoundedSemaphore(maxsize) if maxsize else None
+    built = []
+    next_queue = output_queue
+    for name, func, workers in reversed(stages):
+        stage = Stage(name, func, workers, next_queue, maxsize, stopped)
+        built.insert(0, stage)
+        next_queue = stage.input_queue
+
+    def feed():
+        for sequence, item in enumerate(items):
+            if in_flight is not None:
+                # Poll so a stopped pipeline does not leave the feeder waiting for a slot forever
+                while not in_flight.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        break
+            if stopped.is_set():
+                break
+            built[0].input_queue.put((sequence, item, None))
+        # Closing in order guarantees every item has left a stage before the next one stops
+        for stage in built:
+            stage.close()
+
+    threading.Thread(target=feed, name="pipeline-feeder", daemon=True).start()
+
+    reorder_buffer = {}
+    try:
+        for next_sequence in range(len(items)):
+            while next_sequence not in reorder_buffer:
+                sequence, payload, error = output_queue.get()
+                reorder_buffer[sequence] = (payload, error)
+            payload, error = reorder_buffer.pop(next_sequence)
+            if in_flight is not None:
+                in_flight.release()
+            if error is not None:
+                raise error
+            yield items[next_sequence], payload
+    finally:
+        stopped.set()
@@ -1,25 +1,44 @@
+import json
 import logging
 import os
-import requests
-from tqdm import tqdm
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from index_management.http_client import get_session, get_timeout
+from index_management.metrics import increment, timer
+from index_management.utils import backoff_delay, get_status_code, retry_with_backoff
+from index_management.vectors import serialize_document, to_vector
 
-def create_search_index_if_not_exists(service_name, index_name, semantic_config_name, admin_key, language, vector_config_name):
-    url = f"https://{service_name}.search.windows.net/indexes/{index_name}?api-version=2023-07-01-Preview"
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": admin_key,
-    }
+# Azure AI Search accepts at most 1000 documents and 16 MB per indexing request
+MAX_UPLOAD_BATCH_SIZE = 1000
+MAX_UPLOAD_BATCH_BYTES = 8 * 1024 * 1024
 
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        logging.info(f"Search index {index_name} already exists.")
-        return
-    elif response.status_code == 404:
-        logging.info(f"Search index {index_name} does not exist. Creating a new one.")
-    else:
-        raise Exception(f"Failed to check if search index exists. Error: {response.text}")
+# 207 responses carry a status per document; these ones are worth retrying
+RETRYABLE_STATUS_CODES = (409, 429, 500, 502, 503, 504)
+
+# Chunk keys are "<kind>_<sha1 hex>" (see pdf_processor.make_chunk_id), so splitting each kind on
+# its leading hex digits gives evenly sized export partitions
+CHUNK_KINDS = ("image", "table", "text")
+HEX_DIGITS = "0123456789abcdef"
+# Indexes built before content-derived ids have keys starting with a file counter ("12_image_3_0"),
+# which are split on their leading decimal digits instead
+DECIMAL_DIGITS = "0123456789"
+
+# Indexes known to exist, so a worker checks each one once per process instead of once per job
+_existing_indexes = set()
+_existing_indexes_lock = threading.Lock()
 
-    body = {
+def build_index_schema(semantic_config_name, language, vector_config_name, vector_dimensions=None, hnsw_parameters=None):
+    """Return the index definition; vector_dimensions defaults to VECTOR_DIMENSION and hnsw_parameters
+    (m, efConstruction, efSearch, metric) to the service defaults."""
+    algorithm = {
+        "name": vector_config_name,
+        "kind": "hnsw"
+    }
+    if hnsw_parameters:
+        algorithm["hnswParameters"] = hnsw_parameters
+    return {
         "fields": [
             {
                 "name": "id",
@@ -68,7 +87,7 @@ def create_search_index_if_not_exists(service_name, index_name, semantic_config_
                 "type": "Collection(Edm.Single)",
                 "searchable": True,
                 "retrievable": True,
-                "dimensions": int(os.getenv("VECTOR_DIMENSION", 1536)),
+                "dimensions": vector_dimensions or int(os.getenv("VECTOR_DIMENSION", 1536)),
                 "vectorSearchConfiguration": vector_config_name
             },
         ],
@@ -87,60 +106,346 @@ def create_search_index_if_not_exists(service_name, index_name, semantic_config_
             ]
         },
         "vectorSearch": {
-            "algorithmConfigurations": [
-                {
-                    "name": vector_config_name,
-                    "kind": "hnsw"
-                }
-            ]
+            "algorithmConfigurations": [algorithm]
         }
     }
 
-    response = requests.put(url, json=body, headers=headers)
+def create_search_index_if_not_exists(service_name, index_name, semantic_config_name, admin_key, language, vector_config_name,
+                                      vector_dimensions=None, hnsw_parameters=None):
+    with _existing_indexes_lock:
+        if (service_name, index_name) in _existing_indexes:
+            return
+    url = f"https://{service_name}.search.windows.net/indexes/{index_name}?api-version=2023-07-01-Preview"
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": admin_key,
+    }
+
+    response = get_session().get(url, headers=headers, timeout=get_timeout())
+    if response.status_code == 200:
+        logging.info(f"Search index {index_name} already exists.")
+        with _existing_indexes_lock:
+            _existing_indexes.add((service_name, index_name))
+        return
+    elif response.status_code == 404:
+        logging.info(f"Search index {index_name} does not exist. Creating a new one.")
+    else:
+        raise Exception(f"Failed to check if search index exists. Error: {response.text}")
+
+    body = build_index_schema(semantic_config_name, language, vector_config_name, vector_dimensions, hnsw_parameters)
+
+    response = get_session().put(url, json=body, headers=headers, timeout=get_timeout())
     if response.status_code == 201:
         logging.info(f"Created search index {index_name}")
     elif response.status_code == 204:
         logging.info(f"Updated existing search index {index_name}")
     else:
         raise Exception(f"Failed to create search index. Error: {response.text}")
+    with _existing_indexes_lock:
+        _existing_indexes.add((service_name, index_name))
 
-def delete_documents_from_index(search_client, index_name, blob_names):
-    search_parameters = {
-        "select": "*",
-    }
-    
-    results = search_client.search(search_text="*", **search_parameters)
-    ids_to_delete = []
+def get_search_index(service_name, admin_key, index_name):
+    """Return the definition of an index, or None if it does not exist."""
+    url = f"https://{service_name}.search.windows.net/indexes/{index_name}?api-version=2023-07-01-Preview"
+    response = get_session().get(url, headers={"api-key": admin_key}, timeout=get_timeout())
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise Exception(f"Failed to read search index {index_name}. Error: {response.text}")
+    return response.json()
+
+def index_schema_differences(index, language=None, vector_dimensions=None, hnsw_parameters=None):
+    """List the requested schema settings that an existing index definition does not have."""
+    fields = {field["name"]: field for field in index.get("fields", [])}
+    differences = []
+    if language:
+        for name in ("content", "title"):
+            analyzer = fields.get(name, {}).get("analyzer")
+            if analyzer != f"{language}.lucene":
+                differences.append(f"{name} analyzer is {analyzer}, not {language}.lucene")
+    dimensions = fields.get("contentVector", {}).get("dimensions")
+    expected_dimensions = vector_dimensions or int(os.getenv("VECTOR_DIMENSION", 1536))
+    if dimensions != expected_dimensions:
+        differences.append(f"contentVector has {dimensions} dimensions, not {expected_dimensions}")
+    algorithms = index.get("vectorSearch", {}).get("algorithmConfigurations") or [{}]
+    existing_parameters = algorithms[0].get("hnswParameters") or {}
+    for name, value in (hnsw_parameters or {}).items():
+        if existing_parameters.get(name) != value:
+            differences.append(f"HNSW {name} is {existing_parameters.get(name)}, not {value}")
+    return differences
 
+def sample_vector_dimensions(search_client, sample_size=100):
+    """Return the vector length of the first document in the index that has one, or None."""
+    results = retry_with_backoff(
+        lambda: list(search_client.search(search_text="*", select="id,contentVector", top=sample_size)),
+        lambda e: get_status_code(e) in (None,) + RETRYABLE_STATUS_CODES, name="search_sample")
     for result in results:
-        doc_id = result.get("id")
-        file_path = result.get("filepath")
-        
-        if file_path in blob_names:
-            ids_to_delete.append(doc_id)
-    
+        if result.get("contentVector") is not None:
+            return len(result["contentVector"])
+    return None
+
+def point_alias_to_index(service_name, admin_key, alias_name, index_name):
+    """Create or update an index alias so queries through it switch to index_name at once."""
+    url = f"https://{service_name}.search.windows.net/aliases/{alias_name}?api-version=2023-07-01-Preview"
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": admin_key,
+    }
+    response = get_session().put(url, json={"name": alias_name, "indexes": [index_name]}, headers=headers,
+                                 timeout=get_timeout())
+    if response.status_code not in (200, 201, 204):
+        raise Exception(f"Failed to point alias {alias_name} to {index_name}. Error: {response.text}")
+    logging.info(f"Alias {alias_name} now points to {index_name}")
+
+def build_filepath_filter(blob_names):
+    # OData string literals escape a single quote by doubling it
+    return " or ".join(f"filepath eq '{blob_name.replace(chr(39), chr(39) * 2)}'" for blob_name in blob_names)
+
+def find_document_keys(search_client, blob_names, names_per_filter=50, page_size=1000):
+    """Return the keys of every chunk whose filepath is one of blob_names, fetching only the id field."""
+    blob_names = list(blob_names)
+    keys = []
+    for i in range(0, len(blob_names), names_per_filter):
+        filter = build_filepath_filter(blob_names[i:i + names_per_filter])
+        for page in iter_pages_by_key(search_client, filter, select="id", page_size=page_size, name="search_find_keys"):
+            keys.extend(result["id"] for result in page)
+    return keys
+
+def delete_documents_from_index(search_client, index_name, blob_names, workers=4):
+    """Delete every chunk of blob_names found by filepath. Returns the keys that could not be deleted."""
+    ids_to_delete = find_document_keys(search_client, blob_names)
+
     if not ids_to_delete:
         logging.info("No documents found for the provided blob names.")
-        return
-    
-    delete_actions = [{"@search.action": "delete", "id": doc_id} for doc_id in ids_to_delete]
-    search_client.delete_documents(documents=delete_actions)
-    logging.info(f"Deleted documents with IDs: {ids_to_delete}")
-
-def upload_documents_to_index(search_client, documents, upload_batch_size=50):
-    for i in tqdm(range(0, len(documents), upload_batch_size), desc="Indexing Chunks..."):
-        batch = documents[i:i + upload_batch_size]
-        results = search_client.upload_documents(documents=batch)
-        num_failures = 0
-        errors = set()
+        return []
+
+    return delete_documents_by_key(search_client, ids_to_delete, workers=workers)
+
+def delete_batch(search_client, keys, max_retries=5):
+    """Delete a batch of keys, retrying only the keys that failed transiently.
+
+    Returns a list of (key, error_message) for keys that still failed.
+    """
+    failures = []
+    remaining = keys
+    attempt = 0
+    while remaining:
+        try:
+            results = search_client.delete_documents(documents=[{"@search.action": "delete", "id": key} for key in remaining])
+        except Exception as e:
+            status_code = get_status_code(e)
+            if (status_code is None or status_code in RETRYABLE_STATUS_CODES) and attempt < max_retries:
+                delay = backoff_delay(attempt, error=e)
+                logging.warning(f"Deleting {len(remaining)} documents failed ({e}). Retrying in {delay:.1f}s")
+                increment("search_delete.retries")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            failures.extend((key, str(e)) for key in remaining)
+            break
+
+        retry = []
         for result in results:
-            if not result.succeeded:
-                logging.error(f"Indexing Failed for {result.key} with ERROR: {result.error_message}")
-                num_failures += 1
-                errors.add(result.error_message)
-        if num_failures > 0:
-            raise Exception(f"INDEXING FAILED for {num_failures} documents. Please recreate the index."
-                            f"To Debug: PLEASE CHECK chunk_size and upload_batch_size. \n Error Messages: {list(errors)}")
+            if result.succeeded:
+                continue
+            if result.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+                retry.append(result.key)
+            else:
+                failures.append((result.key, result.error_message))
+        remaining = retry
+        if remaining:
+            delay = backoff_delay(attempt)
+            logging.warning(f"Retrying deletion of {len(remaining)} throttled documents in {delay:.1f}s")
+            increment("search_delete.retries")
+            time.sleep(delay)
+            attempt += 1
+    return failures
+
+def delete_documents_by_key(search_client, keys, batch_size=1000, workers=4):
+    """Delete documents by key in concurrent batches. Returns the keys that could not be deleted."""
+    keys = list(keys)
+    if not keys:
+        return []
+
+    batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deleter") as executor:
+        failures = [failure for batch_failures in executor.map(lambda batch: delete_batch(search_client, batch), batches)
+                    for failure in batch_failures]
+    for key, error_message in failures:
+        logging.error(f"Deleting {key} failed with ERROR: {error_message}")
+    increment("search.documents_deleted", len(keys) - len(failures))
+    increment("search.documents_delete_failed", len(failures))
+    logging.info(f"Deleted {len(keys) - len(failures)} documents in {len(batches)} batches")
+    return [key for key, _ in failures]
+
+def estimate_document_bytes(document):
+    """Approximate the serialized size of a document without JSON-encoding its vector."""
+    vector = document.get("contentVector")
+    other_fields = {key: value for key, value in document.items() if key != "contentVector"}
+    # A float32 rendered as JSON takes at most about 20 characters including the separator
+    return len(json.dumps(other_fields)) + (len(vector) * 20 if vector is not None else 0)
+
+def upload_batch(search_client, batch, max_retries=5):
+    """Upload a batch, retrying only the documents that failed transiently.
+
+    Returns a list of (key, filepath, error_message) for documents that still failed.
+    """
+    failures = []
+    remaining = batch
+    attempt = 0
+    while remaining:
+        try:
+            increment("search.upload_requests")
+            with timer("search.upload"):
+                results = search_client.merge_or_upload_documents(documents=[serialize_document(document) for document in remaining])
+        except Exception as e:
+            status_code = get_status_code(e)
+            if status_code == 413 and len(remaining) > 1:
+                # Size estimate was too optimistic: split the request and try each half
+                middle = len(remaining) // 2
+                return (failures + upload_batch(search_client, remaining[:middle], max_retries)
+                        + upload_batch(search_client, remaining[middle:], max_retries))
+            if (status_code is None or status_code in RETRYABLE_STATUS_CODES) and attempt < max_retries:
+                delay = backoff_delay(attempt, error=e)
+                logging.warning(f"Upload of {len(remaining)} documents failed ({e}). Retrying in {delay:.1f}s")
+                increment("search.retries")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            failures.extend((document["id"], document["filepath"], str(e)) for document in remaining)
+            break
+
+        documents_by_key = {document["id"]: document for document in remaining}
+        retry = []
+        for result in results:
+            if result.succeeded:
+                continue
+            document = documents_by_key[result.key]
+            if result.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+                retry.append(document)
+            else:
+                failures.append((result.key, document["filepath"], result.error_message))
+        remaining = retry
+        if remaining:
+            delay = backoff_delay(attempt)
+            logging.warning(f"Retrying {len(remaining)} throttled documents in {delay:.1f}s")
+            increment("search.retries")
+            time.sleep(delay)
+            attempt += 1
+    return failures
+
+def report_upload_failures(failures):
+    for key, filepath, error_message in failures:
+        logging.error(f"Indexing Failed for {key} ({filepath}) with ERROR: {error_message}")
+    if failures:
+        errors = {error_message for _, _, error_message in failures}
+        logging.error(f"INDEXING FAILED for {len(failures)} documents across "
+                      f"{len({filepath for _, filepath, _ in failures})} files. Error Messages: {list(errors)}")
+
+def upload_documents_to_index(search_client, documents, upload_batch_size=MAX_UPLOAD_BATCH_SIZE,
+                              max_batch_bytes=MAX_UPLOAD_BATCH_BYTES, workers=4):
+    """Upload documents in size-bounded concurrent batches and return the per-document failures."""
+    from tqdm import tqdm
+    with BackgroundUploader(search_client, upload_batch_size=upload_batch_size, max_batch_bytes=max_batch_bytes,
+                            workers=workers) as uploader:
+        for document in tqdm(documents, desc="Indexing Chunks..."):
+            uploader.add(document)
+    report_upload_failures(uploader.failures)
+    return uploader.failures
+
+class BackgroundUploader:
+    """Uploads documents concurrently as size-bounded batches fill.
+
+    A batch is sent once it reaches ``upload_batch_size`` documents or ``max_batch_bytes`` of
+    estimated payload. At most ``max_pending_batches`` batches are queued or in flight; ``add``
+    blocks when the uploader falls behind, which bounds peak memory and makes documents
+    searchable as soon as their batch is sent. Documents that still fail after retries are
+    collected in ``failures`` rather than aborting the run. ``on_batch_uploaded(batch, failures)``
+    is called after every batch, e.g. to checkpoint progress; an error it raises reaches the
+    caller from the next ``add`` or from ``close``.
+    """
+
+    def __init__(self, search_client, upload_batch_size=MAX_UPLOAD_BATCH_SIZE, max_batch_bytes=MAX_UPLOAD_BATCH_BYTES,
+                 workers=4, max_pending_batches=None, max_retries=5, on_batch_uploaded=None):
+        self.search_client = search_client
+        self.upload_batch_size = min(upload_batch_size, MAX_UPLOAD_BATCH_SIZE)
+        self.max_batch_bytes = max_batch_bytes
+        self.max_retries = max_retries
+        self.on_batch_uploaded = on_batch_uploaded
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="uploader")
+        self.slots = threading.BoundedSemaphore(max_pending_batches or workers * 2)
+        self.lock = threading.Lock()
+        self.batch = []
+        self.batch_bytes = 0
+        self.futures = []
+        self.uploaded = 0
+        self.failures = []
+
+    def add(self, document):
+        document_bytes = estimate_document_bytes(document)
+        if self.batch and (len(self.batch) >= self.upload_batch_size
+                           or self.batch_bytes + document_bytes > self.max_batch_bytes):
+            self.flush()
+        self.batch.append(document)
+        self.batch_bytes += document_bytes
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch = self.batch
+        batch_bytes = self.batch_bytes
+        self.batch = []
+        self.batch_bytes = 0
+        increment("search.bytes_sent", batch_bytes)
+        with timer("search.backpressure_wait"):
+            self.slots.acquire()
+        self.futures.append(self.executor.submit(self._upload, batch))
+        self.raise_errors(wait=False)
+
+    def raise_errors(self, wait=True):
+        """Re-raise the first error of a finished batch, and forget the batches that succeeded."""
+        pending = []
+        for future in self.futures:
+            if wait or future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def _upload(self, batch):
+        try:
+            failures = upload_batch(self.search_client, batch, self.max_retries)
+        except Exception as e:
+            failures = [(document["id"], document["filepath"], str(e)) for document in batch]
+        finally:
+            self.slots.release()
+        with self.lock:
+            self.failures.extend(failures)
+            self.uploaded += len(batch) - len(failures)
+            increment("search.documents_uploaded", len(batch) - len(failures))
+            increment("search.documents_failed", len(failures))
+            logging.info(f"Indexed {self.uploaded} chunks so far")
+            if self.on_batch_uploaded is not None:
+                self.on_batch_uploaded(batch, failures)
+
+    def close(self, flush=True):
+        if flush:
+            self.flush()
+        self.batch = []
+        self.executor.shutdown(wait=True)
+        if flush:
+            self.raise_errors()
+        else:
+            for future in self.futures:
+                if future.exception() is not None:
+                    logging.error(f"Upload bookkeeping failed: {future.exception()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # On failure, stop without sending the partial batch and keep the original exception
+        self.close(flush=exc_type is None)
 
 def list_existing_documents(search_client):
     search_parameters = {
@@ -154,3 +459,146 @@ def list_existing_documents(search_client):
         existing_files.add(result.get("filepath"))
     
     return existing_files
+
+def key_partitions(kinds=CHUNK_KINDS, prefix_digits=1):
+    """Return (low, high) key ranges that together cover every possible key; None is an open end.
+
+    Each chunk kind is split into 16 ** prefix_digits ranges, and older counter keys into
+    10 ** (prefix_digits + 1) ranges by their leading digits. The ranges in between catch keys
+    in any other format, so nothing is missed.
+    """
+    prefixes = [""]
+    for _ in range(prefix_digits):
+        prefixes = [prefix + digit for prefix in prefixes for digit in HEX_DIGITS]
+    counter_prefixes = [""]
+    # Counters are not spread evenly over their first digit, so one more digit is used than for hex keys
+    for _ in range(prefix_digits + 1):
+        counter_prefixes = [prefix + digit for prefix in counter_prefixes for digit in DECIMAL_DIGITS]
+    # "g" sorts after every hex digit, closing the last range of a kind
+    boundaries = sorted({f"{kind}_{prefix}" for kind in kinds for prefix in prefixes + ["g"]} | set(counter_prefixes))
+    edges = [None] + boundaries + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+def key_range_filter(low, high):
+    clauses = []
+    if low is not None:
+        clauses.append(f"id ge '{low}'")
+    if high is not None:
+        clauses.append(f"id lt '{high}'")
+    return " and ".join(clauses) or None
+
+def iter_pages_by_key(search_client, filter=None, select=None, page_size=1000, name="search_page"):
+    """Yield pages of results matching filter, in key order.
+
+    Each page starts after the last key of the previous one instead of using $skip, which the
+    service caps at 100,000 and which can repeat or miss results on unordered pages.
+    """
+    after = None
+    while True:
+        clauses = [f"({filter})"] if filter else []
+        if after is not None:
+            clauses.append(f"id gt '{after.replace(chr(39), chr(39) * 2)}'")
+        page_filter = " and ".join(clauses) or None
+        results = retry_with_backoff(
+            lambda: list(search_client.search(search_text="*", filter=page_filter, select=select,
+                                              order_by=["id asc"], top=page_size)),
+            lambda e: get_status_code(e) in (None,) + RETRYABLE_STATUS_CODES, name=name)
+        if results:
+            yield results
+        if len(results) < page_size:
+            return
+        after = results[-1]["id"]
+
+def iter_partition_pages(search_client, low, high, page_size=1000):
+    """Yield pages of whole documents, vectors included, whose keys are in [low, high)."""
+    pages = iter_pages_by_key(search_client, key_range_filter(low, high), page_size=page_size, name="search_export")
+    while True:
+        with timer("search.export_page"):
+            results = next(pages, None)
+        if results is None:
+            return
+        page = [exported_document(result) for result in results]
+        increment("search.documents_exported", len(page))
+        yield page
+
+def exported_document(result):
+    document = {key: value for key, value in result.items() if not key.startswith("@search.")}
+    if document.get("contentVector") is not None:
+        document["contentVector"] = to_vector(document["contentVector"])
+    document["@search.action"] = "mergeOrUpload"
+    return document
+
+def iter_exported_documents(search_client, partitions, workers=8, page_size=1000, max_pending_pages=None):
+    """Yield every document of the index, paging the key partitions concurrently.
+
+    Documents are yielded as their pages arrive, in no particular order. At most
+    ``max_pending_pages`` pages wait in memory, so a slow consumer pauses the export.
+    """
+    pages = queue.Queue(max_pending_pages or workers * 2)
+    stopping = threading.Event()
+    finished = object()
+
+    def export(partition):
+        try:
+            if stopping.is_set():
+                return
+            for page in iter_partition_pages(search_client, *partition, page_size=page_size):
+                pages.put((partition, page))
+                if stopping.is_set():
+                    return
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(finished)
+
+    remaining = len(partitions)
+    partition_counts = {}
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exporter")
+    for partition in partitions:
+        executor.submit(export, partition)
+    try:
+        while remaining:
+            item = pages.get()
+            if item is finished:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                partition, page = item
+                partition_counts[partition] = partition_counts.get(partition, 0) + len(page)
+                yield from page
+        total = sum(partition_counts.values())
+        if partition_counts and total >= 10 * page_size:
+            partition, largest = max(partition_counts.items(), key=lambda item: item[1])
+            if largest > total / 2:
+                logging.warning(f"Key range {partition} held {largest} of {total} exported documents and was read "
+                                f"sequentially. The index keys do not follow the chunk id formats, so the export "
+                                f"workers could not share the work.")
+    finally:
+        # On an error or an abandoned generator, stop the exporters and unblock any waiting on the queue
+        stopping.set()
+        while remaining:
+            if pages.get() is finished:
+                remaining -= 1
+        executor.shutdown(wait=True)
+
+def copy_index_documents(source_client, target_client, partitions, export_workers=8, page_size=1000,
+                         upload_batch_size=MAX_UPLOAD_BATCH_SIZE, max_batch_bytes=MAX_UPLOAD_BATCH_BYTES, upload_workers=4,
+                         max_pending_batches=None, vector_dimensions=None):
+    """Stream every document of the source index into the target index without re-embedding.
+
+    Returns the number of exported documents and the uploader, for its counts and failures.
+    """
+    exported = 0
+    with BackgroundUploader(target_client, upload_batch_size=upload_batch_size, max_batch_bytes=max_batch_bytes,
+                            workers=upload_workers, max_pending_batches=max_pending_batches) as uploader:
+        for document in iter_exported_documents(source_client, partitions, workers=export_workers, page_size=page_size):
+            vector = document.get("contentVector")
+            if vector_dimensions and vector is not None and len(vector) != vector_dimensions:
+                raise Exception(f"Document {document['id']} has a {len(vector)}-dimensional vector but the target index "
+                                f"expects {vector_dimensions}. Changing dimensions needs new embeddings; run upload instead.")
+            uploader.add(document)
+            exported += 1
+            if exported % 10000 == 0:
+                logging.info(f"Exported {exported} documents")
+    return exported, uploader
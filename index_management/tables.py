@@ -0,0 +1,105 @@
+import csv
+import io
+from collections import namedtuple
+from index_management.utils import chunk_text
+
+# cells is a flat row-major list of row_count * column_count strings, so placing a cell is
+# one index computation instead of a dict per cell
+Table = namedtuple("Table", ["row_count", "column_count", "cells", "header_rows", "page_number"])
+
+def build_table(layout_table):
+    """Place a Form Recognizer table's cells on a row-major grid.
+
+    A spanning cell's text goes in its top-left slot. Rows of ``columnHeader`` cells are the
+    header; tables without any take their first row as the header.
+    """
+    row_count, column_count = layout_table.row_count, layout_table.column_count
+    cells = [""] * (row_count * column_count)
+    header_rows = 0
+    for cell in layout_table.cells:
+        cells[cell.row_index * column_count + cell.column_index] = cell.content
+        if getattr(cell, "kind", None) == "columnHeader":
+            header_rows = max(header_rows, cell.row_index + (getattr(cell, "row_span", None) or 1))
+    regions = getattr(layout_table, "bounding_regions", None)
+    page_number = regions[0].page_number - 1 if regions else None
+    return Table(row_count, column_count, cells, header_rows or min(1, row_count), page_number)
+
+def table_rows(table):
+    return [table.cells[row * table.column_count:(row + 1) * table.column_count] for row in range(table.row_count)]
+
+def _markdown_row(row):
+    return "| " + " | ".join(value.replace("|", "\\|").replace("\n", " ") for value in row) + " |\n"
+
+def _csv_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().splitlines(keepends=True)
+
+def table_chunks(table, chunk_size=1000, length_function=len, table_format="markdown"):
+    """Serialize a table into chunks of whole rows, each starting with the table's header.
+
+    Rows are packed greedily up to chunk_size. A single row longer than that is split with
+    the text chunker, without the header.
+    """
+    rows = table_rows(table)
+    header, body = rows[:table.header_rows], rows[table.header_rows:]
+    if table_format == "csv":
+        header_text = "".join(_csv_rows(header))
+        lines = _csv_rows(body)
+    else:
+        header_text = "".join(_markdown_row(row) for row in header)
+        if header:
+            header_text += "|" + " --- |" * table.column_count + "\n"
+        lines = [_markdown_row(row) for row in body]
+
+    header_length = length_function(header_text)
+    if not lines:
+        return [header_text.rstrip("\n")] if header_text.strip() else []
+
+    chunks = []
+    current = []
+    current_length = header_length
+    for line in lines:
+        line_length = length_function(line)
+        if current and current_length + line_length > chunk_size:
+            chunks.append(header_text + "".join(current))
+            current = []
+            current_length = header_length
+        if header_length + line_length > chunk_size:
+            chunks.extend(chunk_text(line, chunk_size, 0, length_function))
+            continue
+        current.append(line)
+        current_length += line_length
+    if current:
+        chunks.append(header_text + "".join(current))
+    return [chunk.rstrip("\n") for chunk in chunks]
+
+def table_regions(layout_result):
+    """Return {page_number: [(x0, y0, x1, y1), ...]} of table areas in PDF points, with 0-based pages."""
+    units = {page.page_number: getattr(page, "unit", "inch") for page in getattr(layout_result, "pages", None) or []}
+    regions = {}
+    for layout_table in layout_result.tables:
+        for region in getattr(layout_table, "bounding_regions", None) or []:
+            # azure-ai-formrecognizer 3.2.0b2 calls the corner points bounding_box; later versions polygon
+            polygon = getattr(region, "polygon", None) or getattr(region, "bounding_box", None)
+            if not polygon:
+                continue
+            # Layout reports PDF coordinates in inches; PyMuPDF works in points
+            scale = 72 if units.get(region.page_number, "inch") == "inch" else 1
+            xs = [point.x * scale for point in polygon]
+            ys = [point.y * scale for point in polygon]
+            regions.setdefault(region.page_number - 1, []).append((min(xs), min(ys), max(xs), max(ys)))
+    return regions
+
+def _inside(block, rects, tolerance=2):
+    center_x, center_y = (block[0] + block[2]) / 2, (block[1] + block[3]) / 2
+    return any(x0 - tolerance <= center_x <= x1 + tolerance and y0 - tolerance <= center_y <= y1 + tolerance
+               for x0, y0, x1, y1 in rects)
+
+def page_text_outside_tables(page, rects):
+    """Text of a PyMuPDF page without the text blocks that lie inside the given table areas."""
+    if not rects:
+        return page.get_text("text")
+    # Blocks are (x0, y0, x1, y1, text, block_no, block_type); type 1 is an image
+    texts = [block[4] for block in page.get_text("blocks") if block[6] == 0 and not _inside(block, rects)]
+    return "".join(text if text.endswith("\n") else text + "\n" for text in texts)
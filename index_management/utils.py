@@ -1,15 +1,83 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import logging
+import os
+import random
+import re
 import tempfile
+import time
+from collections import namedtuple
+from index_management.metrics import increment
 
-def chunk_text(text, chunk_size=1000, chunk_overlap=200):
-    text_splitter = RecursiveCharacterTextSplitter(
-       chunk_size=chunk_size, 
-       chunk_overlap=chunk_overlap,
-       length_function=len,
-       is_separator_regex=False
-    )
-    return text_splitter.split_text(text)
+# Paragraphs, then lines, then words; anything still too long is cut at the size limit.
+# Each pattern splits after the separator so pieces keep their original text and offsets.
+CHUNK_SEPARATORS = [re.compile(r"(?<=\n\n)"), re.compile(r"(?<=\n)"), re.compile(r"(?<= )")]
+
+Chunk = namedtuple("Chunk", ["text", "page_number", "offset"])
+
+def token_length_function(model="text-embedding-ada-002"):
+    """Return a function counting tokens as the embedding model does, or estimating them without tiktoken."""
+    try:
+        import tiktoken
+    except ImportError:
+        return lambda text: max(1, len(text) // 4) if text else 0
+    encoding = tiktoken.encoding_for_model(model)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+def _split_piece(text, offset, chunk_size, length_function, level=0):
+    if length_function(text) <= chunk_size:
+        yield text, offset
+        return
+    if level == len(CHUNK_SEPARATORS):
+        for start in range(0, len(text), chunk_size):
+            yield text[start:start + chunk_size], offset + start
+        return
+    for part in CHUNK_SEPARATORS[level].split(text):
+        if part:
+            yield from _split_piece(part, offset, chunk_size, length_function, level + 1)
+        offset += len(part)
+
+def iter_chunks(pages, chunk_size=1000, chunk_overlap=200, length_function=len):
+    """Split an iterable of (page_number, text) into overlapping chunks without joining the pages.
+
+    Pieces are merged greedily up to ``chunk_size`` as measured by ``length_function`` (characters
+    by default, or tokens via token_length_function), and each chunk starts with up to
+    ``chunk_overlap`` of the previous one. Chunks may span pages; each records the page and
+    character offset where it starts.
+    """
+    current = []
+    current_length = 0
+
+    def emit():
+        text = "".join(piece for piece, _, _, _ in current)
+        stripped = text.lstrip()
+        if stripped.strip():
+            _, page_number, offset, _ = current[0]
+            return Chunk(stripped.rstrip(), page_number, offset + len(text) - len(stripped))
+        return None
+
+    for page_number, page_text in pages:
+        if not page_text:
+            continue
+        if not page_text.endswith("\n"):
+            # Keep words on either side of a page break apart, as the old "\n".join of pages did
+            page_text += "\n"
+        for piece, offset in _split_piece(page_text, 0, chunk_size, length_function):
+            piece_length = length_function(piece)
+            if current and current_length + piece_length > chunk_size:
+                chunk = emit()
+                if chunk is not None:
+                    yield chunk
+                while current and (current_length > chunk_overlap or current_length + piece_length > chunk_size):
+                    current_length -= current.pop(0)[3]
+            current.append((piece, page_number, offset, piece_length))
+            current_length += piece_length
+
+    if current:
+        chunk = emit()
+        if chunk is not None:
+            yield chunk
+
+def chunk_text(text, chunk_size=1000, chunk_overlap=200, length_function=len):
+    return [chunk.text for chunk in iter_chunks([(0, text)], chunk_size, chunk_overlap, length_function)]
 
 def read_blob_content(blob_client):
     """Read the contents of a blob."""
@@ -35,3 +103,45 @@ def read_blob_content(blob_client):
     except Exception as e:
         logging.error(f"Error reading blob content: {e}")
         return None
+
+def get_status_code(error):
+    """Return the HTTP status code carried by an SDK or requests exception, if any."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+def get_retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0, error=None):
+    """Seconds to wait before retry number ``attempt``, honouring a Retry-After header when present."""
+    delay = (get_retry_after(error) if error is not None else None) or min(max_delay, base_delay * (2 ** attempt))
+    return delay + random.uniform(0, delay / 4)
+
+def retry_with_backoff(func, should_retry, max_retries=5, base_delay=1.0, max_delay=60.0, name=None):
+    """Call func, retrying with exponential backoff and jitter while should_retry(error) is true.
+
+    With a name, each retry is counted as ``<name>.retries`` and throttling as ``<name>.throttled``.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not should_retry(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay, e)
+            if name is not None:
+                increment(f"{name}.retries")
+                if get_status_code(e) == 429:
+                    increment(f"{name}.throttled")
+            logging.warning(f"Request throttled or failed ({e}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            attempt += 1
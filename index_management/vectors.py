@@ -0,0 +1,35 @@
+import base64
+import math
+from array import array
+
+# Embeddings are kept as contiguous float32 buffers: 4 bytes per dimension instead of a
+# Python float object plus a list slot for each one
+VECTOR_TYPECODE = "f"
+
+def to_vector(embedding):
+    """Convert an embedding from an API response (base64 string, bytes or list) to a float32 array."""
+    if isinstance(embedding, array):
+        return embedding
+    if isinstance(embedding, str):
+        embedding = base64.b64decode(embedding)
+    return array(VECTOR_TYPECODE, embedding)
+
+def encode_vector(vector):
+    return base64.b64encode(to_vector(vector).tobytes()).decode("ascii")
+
+def decode_vector(encoded):
+    return to_vector(encoded)
+
+def summarize_vector(vector):
+    """Short description of a vector for logs, instead of printing every component."""
+    norm = math.sqrt(sum(value * value for value in vector))
+    head = ", ".join(f"{value:.4f}" for value in vector[:3])
+    return f"float32[{len(vector)}] norm={norm:.4f} [{head}, ...]"
+
+def serialize_document(document):
+    """Return the document with its vector as a JSON-ready list, for the upload request only."""
+    vector = document.get("contentVector")
+    if isinstance(vector, array):
+        document = dict(document)
+        document["contentVector"] = vector.tolist()
+    return document
@@ -0,0 +1,303 @@
+import json
+import logging
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+OPERATIONS = ("upload", "sync", "delete")
+
+Job = namedtuple("Job", ["id", "receipt", "body", "dequeue_count"])
+
+def make_job(operation, index_name, container_name, blob_names=None):
+    if operation not in OPERATIONS:
+        raise Exception(f"Operation {operation} cannot be queued. Expected one of {OPERATIONS}.")
+    return {"operation": operation, "index": index_name, "container": container_name, "blob_names": blob_names or []}
+
+def lease_name(body):
+    return f"{body['index']}__{body['container']}"
+
+class AzureJobQueue:
+    """Job queue on an Azure Storage queue; received messages stay invisible for the visibility timeout.
+
+    Leases are blob leases on empty blobs in ``lease_container`` of the same storage account, so
+    they hold across worker processes and hosts.
+    """
+
+    # Blob leases last between 15 and 60 seconds unless they are infinite
+    max_lease_duration = 60
+
+    def __init__(self, connection_string, queue_name, lease_container="job-leases"):
+        from azure.storage.blob import BlobServiceClient
+        from azure.storage.queue import QueueClient
+        self.queue_client = QueueClient.from_connection_string(connection_string, queue_name)
+        self.lease_container_client = BlobServiceClient.from_connection_string(connection_string).get_container_client(lease_container)
+        self.lease_container_ready = False
+
+    def send(self, body, delay=None):
+        self.queue_client.send_message(json.dumps(body), visibility_timeout=delay)
+
+    def postpone(self, job, delay):
+        """Put a job back for later without counting the delivery as a failed attempt."""
+        # A fresh message restarts the dequeue count; sent first so the job is never lost in between
+        self.send(job.body, delay=int(delay))
+        self.delete(job)
+
+    def acquire_lease(self, name, duration):
+        """Return a lease on name, or None if another worker holds it."""
+        from azure.core.exceptions import HttpResponseError, ResourceExistsError
+        if not self.lease_container_ready:
+            try:
+                self.lease_container_client.create_container()
+            except ResourceExistsError:
+                pass
+            self.lease_container_ready = True
+        blob_client = self.lease_container_client.get_blob_client(name)
+        try:
+            blob_client.upload_blob(b"", overwrite=False)
+        except ResourceExistsError:
+            pass
+        try:
+            return blob_client.acquire_lease(lease_duration=min(max(int(duration), 15), self.max_lease_duration))
+        except HttpResponseError as e:
+            if e.status_code == 409:
+                return None
+            raise
+
+    def renew_lease(self, name, lease, duration):
+        lease.renew()
+        return lease
+
+    def release_lease(self, name, lease):
+        lease.release()
+
+    def receive(self, max_messages, visibility_timeout):
+        messages = self.queue_client.receive_messages(messages_per_page=max_messages, visibility_timeout=visibility_timeout,
+                                                      max_messages=max_messages)
+        return [Job(message.id, message.pop_receipt, json.loads(message.content), message.dequeue_count)
+                for message in messages]
+
+    def extend(self, job, visibility_timeout):
+        updated = self.queue_client.update_message(job.id, pop_receipt=job.receipt, visibility_timeout=visibility_timeout)
+        return job._replace(receipt=updated.pop_receipt)
+
+    def delete(self, job):
+        self.queue_client.delete_message(job.id, pop_receipt=job.receipt)
+
+class SqliteJobQueue:
+    """Local stand-in for AzureJobQueue with the same visibility-timeout and lease semantics.
+
+    Pass ":memory:" for a queue private to one process, or a file path to share it between
+    worker processes on one machine.
+    """
+
+    max_lease_duration = None
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, body TEXT NOT NULL, visible_at REAL NOT NULL, receipt TEXT, dequeue_count INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def send(self, body, delay=None):
+        with self.lock:
+            self.connection.execute("INSERT INTO jobs (id, body, visible_at, receipt, dequeue_count) VALUES (?, ?, ?, NULL, 0)",
+                                    (uuid.uuid4().hex, json.dumps(body), time.time() + (delay or 0)))
+
+    def postpone(self, job, delay):
+        """Put a job back for later without counting the delivery as a failed attempt."""
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET visible_at = ?, dequeue_count = dequeue_count - 1 "
+                                    "WHERE id = ? AND receipt = ?", (time.time() + delay, job.id, job.receipt))
+
+    def acquire_lease(self, name, duration):
+        """Return a lease token for name, or None if another worker holds it."""
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO leases (name, token, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at <= ?", (name, token, now + duration, now))
+        return token if cursor.rowcount else None
+
+    def renew_lease(self, name, token, duration):
+        with self.lock:
+            cursor = self.connection.execute("UPDATE leases SET expires_at = ? WHERE name = ? AND token = ?",
+                                             (time.time() + duration, name, token))
+        if cursor.rowcount == 0:
+            raise Exception(f"Lease on {name} was lost.")
+        return token
+
+    def release_lease(self, name, token):
+        with self.lock:
+            self.connection.execute("DELETE FROM leases WHERE name = ? AND token = ?", (name, token))
+
+    def receive(self, max_messages, visibility_timeout):
+        now = time.time()
+        jobs = []
+        with self.lock:
+            # BEGIN IMMEDIATE keeps two worker processes from claiming the same job
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute("SELECT id, body, dequeue_count FROM jobs WHERE visible_at <= ? "
+                                               "ORDER BY visible_at LIMIT ?", (now, max_messages)).fetchall()
+                for job_id, body, dequeue_count in rows:
+                    receipt = uuid.uuid4().hex
+                    self.connection.execute("UPDATE jobs SET visible_at = ?, receipt = ?, dequeue_count = ? WHERE id = ?",
+                                            (now + visibility_timeout, receipt, dequeue_count + 1, job_id))
+                    jobs.append(Job(job_id, receipt, json.loads(body), dequeue_count + 1))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return jobs
+
+    def extend(self, job, visibility_timeout):
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET visible_at = ? WHERE id = ? AND receipt = ?",
+                                             (time.time() + visibility_timeout, job.id, job.receipt))
+        if cursor.rowcount == 0:
+            raise Exception(f"Job {job.id} was claimed by another worker.")
+        return job
+
+    def delete(self, job):
+        with self.lock:
+            self.connection.execute("DELETE FROM jobs WHERE id = ? AND receipt = ?", (job.id, job.receipt))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+class Worker:
+    """Long-running consumer that runs queued jobs for many index/container pairs concurrently.
+
+    Up to ``concurrency`` jobs run at once. A job holds a lease on its index and container pair,
+    taken from the job queue, because jobs for the pair share a manifest and a journal. A job
+    whose pair is leased by another job, in this worker or another one, is postponed by
+    ``poll_interval`` without counting as an attempt. While a job runs its visibility and lease
+    are renewed, so another worker only picks it up if this one dies. A failed job becomes
+    visible again when its timeout expires. After ``max_attempts`` deliveries it is logged and
+    dropped. Scale out by starting more workers on the same queue, with the manifest and
+    journal directories on storage they all share.
+    """
+
+    def __init__(self, job_queue, handle_job, concurrency=4, visibility_timeout=300, poll_interval=5, max_attempts=5):
+        self.job_queue = job_queue
+        self.handle_job = handle_job
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.leases = {}
+        self.postponed_until = 0
+        self.lease_duration = min(visibility_timeout, getattr(job_queue, "max_lease_duration", None) or visibility_timeout)
+        self.stopping = threading.Event()
+        self.finished = threading.Event()
+
+    def stop(self, *_):
+        logging.info("Worker stopping after the jobs in flight finish.")
+        self.stopping.set()
+
+    def _run_job(self, job_id):
+        with self.lock:
+            job = self.in_flight[job_id]
+        body = job.body
+        name = lease_name(body)
+        lease = None
+        try:
+            lease = self.job_queue.acquire_lease(name, self.lease_duration)
+            if lease is None:
+                logging.info(f"Postponing {body['operation']} job: index {body['index']}, container {body['container']} "
+                             f"is busy with another job")
+                self.job_queue.postpone(job, self.poll_interval)
+                with self.lock:
+                    self.postponed_until = max(self.postponed_until, time.time() + self.poll_interval)
+                return
+            with self.lock:
+                self.leases[job_id] = (name, lease)
+            logging.info(f"Running {body['operation']} job for index {body['index']}, container {body['container']}")
+            self.handle_job(body)
+            # The receipt may have been renewed while the job ran
+            with self.lock:
+                job = self.in_flight[job_id]
+            self.job_queue.delete(job)
+            logging.info(f"Finished {body['operation']} job for index {body['index']}, container {body['container']}")
+        except Exception as e:
+            with self.lock:
+                job = self.in_flight[job_id]
+            logging.error(f"Job {body} failed on attempt {job.dequeue_count}: {e}")
+            if job.dequeue_count >= self.max_attempts:
+                logging.error(f"Dropping job {body} after {job.dequeue_count} attempts.")
+                self.job_queue.delete(job)
+        finally:
+            with self.lock:
+                self.in_flight.pop(job_id, None)
+                name, lease = self.leases.pop(job_id, (name, lease))
+            if lease is not None:
+                try:
+                    self.job_queue.release_lease(name, lease)
+                except Exception as e:
+                    logging.warning(f"Could not release lease on {name}; it expires on its own: {e}")
+
+    def _renew_visibility(self):
+        while not self.finished.wait(self.lease_duration / 3):
+            with self.lock:
+                jobs = list(self.in_flight.items())
+                leases = list(self.leases.items())
+            for job_id, (name, lease) in leases:
+                try:
+                    renewed = self.job_queue.renew_lease(name, lease, self.lease_duration)
+                    with self.lock:
+                        if job_id in self.leases:
+                            self.leases[job_id] = (name, renewed)
+                except Exception as e:
+                    logging.warning(f"Could not renew lease on {name}: {e}")
+            for job_id, job in jobs:
+                try:
+                    renewed = self.job_queue.extend(job, self.visibility_timeout)
+                    with self.lock:
+                        if job_id in self.in_flight:
+                            self.in_flight[job_id] = renewed
+                except Exception as e:
+                    logging.warning(f"Could not renew visibility of job {job.body}: {e}")
+
+    def run(self, install_signal_handlers=True, idle_exit=False):
+        """Consume jobs until stopped, or until the queue is empty when idle_exit is set."""
+        if install_signal_handlers:
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+        renewer = threading.Thread(target=self._renew_visibility, name="visibility-renewer", daemon=True)
+        renewer.start()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job") as executor:
+            while not self.stopping.is_set():
+                with self.lock:
+                    free_slots = self.concurrency - len(self.in_flight)
+                jobs = self.job_queue.receive(min(free_slots, 32), self.visibility_timeout) if free_slots > 0 else []
+                for job in jobs:
+                    if job.body.get("operation") not in OPERATIONS:
+                        logging.error(f"Dropping malformed job {job.body}")
+                        self.job_queue.delete(job)
+                        continue
+                    with self.lock:
+                        self.in_flight[job.id] = job
+                    executor.submit(self._run_job, job.id)
+                if not jobs:
+                    with self.lock:
+                        # A postponed job is not visible yet, but the queue is not empty
+                        idle = not self.in_flight and time.time() > self.postponed_until
+                    if idle_exit and idle:
+                        break
+                    self.stopping.wait(self.poll_interval)
+        self.finished.set()
+        renewer.join()